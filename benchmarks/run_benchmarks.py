@@ -0,0 +1,214 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Callable, Dict, List, Any, Optional
+from benchmarks.synthetic import gen_price_panel, gen_prices_db
+from data_process.data_fetcher import fetch_securities
+from strategy import pairs_selection, backtesting
+from webapp.result_store import ResultStore
+
+curr_dir_path = Path(__file__).resolve().parent
+DEFAULT_BASELINE_PATH = os.path.join(curr_dir_path, "baselines", "baseline.json")
+DEFAULT_UNIVERSE_SIZES = [50, 100, 500]
+DEFAULT_YEARS = [1, 3, 5]
+# A benchmark is reported as a regression when it gets this much slower than its baseline
+DEFAULT_REGRESSION_THRESHOLD = 1.25
+# and at least this many seconds slower, timings of a few ms are too noisy to flag on their ratio alone
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def _measure(func: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """
+    :param func: What to benchmark
+    :param repeat: Number of timed runs, the best one is kept
+    :return: Best wall time in seconds and peak memory in MB. The peak is measured in a separate run, as tracing
+             the allocations slows the code down
+    """
+    wall_times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        wall_times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"wall_s": min(wall_times), "peak_mb": peak_bytes / 1024 ** 2}
+
+
+def _json_round_trip(prices_df: pd.DataFrame, pairs_df: pd.DataFrame):
+    # What start_app used to do to pass the prices and pairs through the DOM
+    prices_json = prices_df.reset_index().assign(
+        close_date=lambda df: df["close_date"].dt.strftime("%Y-%m-%d")).to_json(orient="records")
+    pairs_json = pairs_df.reset_index().to_json(orient="records")
+    pd.read_json(prices_json).set_index("close_date")
+    pd.read_json(pairs_json).set_index("PAIR")
+
+
+def gen_benchmarks(prices_df: pd.DataFrame, store_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    :param prices_df: Output of gen_price_panel
+    :param store_dir: Scratch directory for the result store
+    :return: Function to benchmark and number of pairs it handles, by benchmark name
+    """
+    all_securities = pairs_selection.get_scoreable_securities(prices_df)
+    returns_df = prices_df.pct_change().dropna()
+    returns = returns_df[all_securities].to_numpy(dtype=np.float64)
+    index_returns = returns_df["index"].to_numpy(dtype=np.float64)
+    pair_i, pair_j = np.triu_indices(len(all_securities), k=1)
+    n_pairs = len(pair_i)
+
+    pairs_df = pairs_selection.generate_pairs_and_scores(prices_df=prices_df)
+    chosen_pairs = list(pairs_selection.select_top_n_pairs(generated_pairs_df=pairs_df,
+                                                           selection_method="MDM",
+                                                           n=5).index)
+    db_conn = gen_prices_db(prices_df)
+    long_prices = db_conn.query_db("SELECT security_code, close_date, adj_close FROM security_prices")
+    result_store = ResultStore(root_dir=store_dir, max_entries=1)
+
+    return {
+        "score_mdm": {"func": lambda: pairs_selection.generate_mdm_scores(returns=returns, pair_i=pair_i,
+                                                                           pair_j=pair_j),
+                      "n_pairs": n_pairs},
+        "score_mfr": {"func": lambda: pairs_selection.generate_mfr_matrix(
+            pairs_selection.generate_betas(returns=returns, index_returns=index_returns))[pair_i, pair_j],
+                      "n_pairs": n_pairs},
+        "score_granger": {"func": lambda: pairs_selection.generate_granger_scores(returns=returns, pair_i=pair_i,
+                                                                                   pair_j=pair_j),
+                          "n_pairs": n_pairs},
+        "score_cointegration": {"func": lambda: pairs_selection.generate_pairs_and_scores(prices_df=prices_df,
+                                                                                          methods=["EG", "HL"]),
+                                "n_pairs": n_pairs},
+        "generate_pairs_and_scores": {"func": lambda: pairs_selection.generate_pairs_and_scores(prices_df=prices_df),
+                                      "n_pairs": n_pairs},
+        "select_top_n_pairs": {"func": lambda: pairs_selection.select_top_n_pairs(generated_pairs_df=pairs_df,
+                                                                                  selection_method="MDM",
+                                                                                  n=5),
+                               "n_pairs": n_pairs},
+        "get_performance": {"func": lambda: backtesting.get_performance(
+            chosen_pairs=chosen_pairs,
+            prices_df=prices_df,
+            test_start_date=prices_df.index[len(prices_df) // 2],
+            window_size=30,
+            open_threshold=2,
+            close_threshold=0),
+                            "n_pairs": len(chosen_pairs)},
+        "json_round_trip": {"func": lambda: _json_round_trip(prices_df=prices_df, pairs_df=pairs_df),
+                            "n_pairs": n_pairs},
+        "result_store_round_trip": {"func": lambda: ResultStore(root_dir=store_dir).get(
+            result_store.put(frames={"prices": prices_df, "pairs": pairs_df})),
+                                    "n_pairs": n_pairs},
+        "fetch_prices": {"func": lambda: fetch_securities.fetch_prices(db_conn=db_conn,
+                                                                       securities_list=list(prices_df.columns),
+                                                                       start_date=prices_df.index[0],
+                                                                       end_date=prices_df.index[-1]),
+                         "n_pairs": None},
+        "fetch_prices_pivot": {"func": lambda: long_prices.set_index(["close_date", "security_code"])[
+            "adj_close"].sort_index().unstack("security_code"),
+                               "n_pairs": None},
+    }
+
+
+def run_benchmarks(universe_sizes: List[int],
+                   years: List[int],
+                   repeat: int = 3,
+                   benchmark_names: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Run every benchmark on synthetic panels of every universe size and number of years
+    :param universe_sizes: Numbers of securities
+    :param years: Numbers of years of daily bars
+    :param repeat: Number of timed runs per benchmark, the best one is kept
+    :param benchmark_names: Only run these benchmarks, all of them by default
+    :return: Wall time, peak memory and pairs per second of every benchmark
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        for n_securities in universe_sizes:
+            for n_years in years:
+                prices_df = gen_price_panel(n_securities=n_securities, n_years=n_years)
+                for name, benchmark in gen_benchmarks(prices_df=prices_df, store_dir=store_dir).items():
+                    if benchmark_names is not None and name not in benchmark_names:
+                        continue
+                    measures = _measure(func=benchmark["func"], repeat=repeat)
+                    n_pairs = benchmark["n_pairs"]
+                    results.append({"benchmark": name,
+                                    "n_securities": n_securities,
+                                    "n_years": n_years,
+                                    **measures,
+                                    "pairs_per_s": np.nan if n_pairs is None else n_pairs / measures["wall_s"]})
+                    print(f"{name} N={n_securities} {n_years}y: {measures['wall_s']:.4f}s "
+                          f"{measures['peak_mb']:.1f}MB", file=sys.stderr)
+    return pd.DataFrame(results)
+
+
+def save_baseline(results_df: pd.DataFrame, path: str):
+    """
+    Save the results along with the versions they were measured with
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    baseline = {"meta": {"created_at": pd.Timestamp.now().isoformat(),
+                         "python": platform.python_version(),
+                         "numpy": np.__version__,
+                         "pandas": pd.__version__,
+                         "machine": platform.platform()},
+                "results": json.loads(results_df.to_json(orient="records"))}
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+
+
+def compare_to_baseline(results_df: pd.DataFrame,
+                        path: str,
+                        threshold: float = DEFAULT_REGRESSION_THRESHOLD) -> pd.DataFrame:
+    """
+    :param results_df: Output of run_benchmarks
+    :param path: Baseline saved with save_baseline
+    :param threshold: Ratio of wall times above which a benchmark is flagged as a regression
+    :return: Results next to the baseline ones, with their ratio and whether it is a regression
+    """
+    with open(path, "r") as f:
+        baseline_df = pd.DataFrame(json.load(f)["results"])
+    keys = ["benchmark", "n_securities", "n_years"]
+    comparison_df = results_df.merge(baseline_df[keys + ["wall_s", "peak_mb"]], on=keys, how="left",
+                                     suffixes=("", "_baseline"))
+    comparison_df["wall_ratio"] = comparison_df["wall_s"] / comparison_df["wall_s_baseline"]
+    comparison_df["regression"] = ((comparison_df["wall_ratio"] > threshold) &
+                                   (comparison_df["wall_s"] - comparison_df["wall_s_baseline"] > MIN_REGRESSION_SECONDS))
+    return comparison_df
+
+
+## RUN
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark pair scoring, backtesting and data handling")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_UNIVERSE_SIZES, help="Numbers of securities")
+    parser.add_argument("--years", type=int, nargs="+", default=DEFAULT_YEARS, help="Numbers of years of daily bars")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark, the best one is kept")
+    parser.add_argument("--only", nargs="+", help="Only run these benchmarks")
+    parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE_PATH, help="Save the results as a baseline")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE_PATH, help="Compare to a saved baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                        help="Slow down ratio flagged as a regression")
+    args = parser.parse_args()
+
+    benchmark_results = run_benchmarks(universe_sizes=args.sizes, years=args.years, repeat=args.repeat,
+                                       benchmark_names=args.only)
+    pd.set_option("display.width", 200)
+    if args.compare:
+        comparison = compare_to_baseline(results_df=benchmark_results, path=args.compare, threshold=args.threshold)
+        print(comparison.round(4).to_string(index=False))
+        if comparison["regression"].any():
+            print(f"\n{comparison['regression'].sum()} benchmarks regressed by more than {args.threshold}x")
+            sys.exit(1)
+    else:
+        print(benchmark_results.round(4).to_string(index=False))
+    if args.save:
+        save_baseline(results_df=benchmark_results, path=args.save)
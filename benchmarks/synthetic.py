@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+from data_process.db_connector.sqlite_connector import SqliteConnector
+
+# Number of trading days in a year of daily bars
+TRADING_DAYS_PER_YEAR = 252
+
+
+def gen_price_panel(n_securities: int, n_years: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic daily prices driven by a common market factor, in the same shape as get_all_data's output
+    :param n_securities: Number of constituents
+    :param n_years: Number of years of daily bars
+    :param seed: Seed of the random generator
+    :return: close_date x security_code prices, with the index prices in an "index" column
+    """
+    rng = np.random.default_rng(seed)
+    n_days = n_years * TRADING_DAYS_PER_YEAR
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_days, name="close_date")
+    market_returns = rng.normal(0.0003, 0.01, n_days)
+    betas = rng.uniform(0.5, 1.5, n_securities)
+    returns = market_returns[:, None] * betas + rng.normal(0, 0.015, (n_days, n_securities))
+    prices_df = pd.DataFrame(100 * np.cumprod(1 + returns, axis=0),
+                             index=dates,
+                             columns=pd.Index([f"S{sec:04d}" for sec in range(n_securities)], name="security_code"))
+    prices_df["index"] = 100 * np.cumprod(1 + market_returns)
+    return prices_df
+
+
+def gen_prices_db(prices_df: pd.DataFrame) -> SqliteConnector:
+    """
+    In memory SQLite stand in for the security_prices table, holding the given prices
+    :param prices_df: Output of gen_price_panel
+    """
+    db_conn = SqliteConnector()
+    long_prices = prices_df.stack().rename("adj_close").reset_index()
+    long_prices.columns = ["close_date", "security_code", "adj_close"]
+    db_conn.insert_df("security_prices", long_prices)
+    with db_conn.engine.begin() as conn:
+        conn.exec_driver_sql("CREATE INDEX security_prices_code_date ON security_prices (security_code, close_date)")
+    return db_conn
@@ -0,0 +1,93 @@
+import threading
+import time
+import pandas as pd
+from datetime import datetime
+from typing import Dict, Optional
+from data_process.db_connector.mysql_connector import MySqlConnector
+
+
+class ConstituentsIndex:
+    """
+    In memory copy of every snapshot of an index, restricted to the securities that have prices, so that the
+    constituents for any sim_start_date and sim_end_date are resolved without going to the DB. An index is
+    loaded on its first lookup and reloaded when a newer snapshot arrives, which is checked at most every
+    refresh_interval seconds
+    """
+
+    def __init__(self, db_conn: MySqlConnector, refresh_interval: float = 300):
+        """
+        :param db_conn: DB connection
+        :param refresh_interval: Seconds between two checks for new snapshots of an index
+        """
+        self.db_conn = db_conn
+        self.refresh_interval = refresh_interval
+        # Snapshot rows of every loaded index, and the latest snapshot date they were loaded at
+        self._snapshots: Dict[str, pd.DataFrame] = {}
+        self._latest_snapshot_dates: Dict[str, Optional[pd.Timestamp]] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _fetch_latest_snapshot_date(self, index_code: str) -> Optional[pd.Timestamp]:
+        query = """
+            SELECT MAX(snapshot_date) AS max_snapshot_date FROM index_constituents
+            WHERE index_code = :index_code
+        """
+        max_snapshot_date = self.db_conn.query_db(query=query, params={"index_code": index_code})
+        max_snapshot_date = max_snapshot_date["max_snapshot_date"].iloc[0]
+        return None if pd.isnull(max_snapshot_date) else pd.Timestamp(max_snapshot_date)
+
+    def _fetch_snapshots(self, index_code: str) -> pd.DataFrame:
+        query = """
+            SELECT snapshot_date, security_code, pct_weight FROM index_constituents AS ic
+            WHERE index_code = :index_code AND
+                -- Making sure we only get security codes for which prices exist
+                EXISTS (SELECT 1 FROM security_prices WHERE security_prices.security_code = ic.security_code)
+        """
+        snapshots = self.db_conn.query_db(query=query, params={"index_code": index_code})
+        snapshots["snapshot_date"] = pd.to_datetime(snapshots["snapshot_date"])
+        return snapshots.sort_values(["snapshot_date", "security_code"]).reset_index(drop=True)
+
+    def _refresh_if_needed(self, index_code: str):
+        now = time.monotonic()
+        if index_code in self._snapshots and now - self._checked_at[index_code] < self.refresh_interval:
+            return
+        latest_snapshot_date = self._fetch_latest_snapshot_date(index_code)
+        if index_code not in self._snapshots or latest_snapshot_date != self._latest_snapshot_dates[index_code]:
+            self._snapshots[index_code] = self._fetch_snapshots(index_code)
+            self._latest_snapshot_dates[index_code] = latest_snapshot_date
+        self._checked_at[index_code] = now
+
+    def get_constituents(self,
+                         index_code: str,
+                         sim_start_date: datetime,
+                         sim_end_date: datetime) -> pd.DataFrame:
+        """
+        Same as fetch_securities.fetch_index_constituents, served from memory
+        :param index_code: Index to get the constituents of
+        :param sim_start_date: The securities need to be in the latest snapshot as of this date
+        :param sim_end_date: and in the latest snapshot as of this date
+        :return: security_code and pct_weight as of sim_end_date, largest weight first
+        """
+        with self._lock:
+            self._refresh_if_needed(index_code)
+            snapshots = self._snapshots[index_code]
+        snapshot_dates = snapshots["snapshot_date"]
+        start_snapshot_date = snapshot_dates[snapshot_dates <= pd.Timestamp(sim_start_date)].max()
+        end_snapshot_date = snapshot_dates[snapshot_dates <= pd.Timestamp(sim_end_date)].max()
+        start_securities = snapshots.loc[snapshot_dates == start_snapshot_date, "security_code"]
+        constituents = snapshots.loc[(snapshot_dates == end_snapshot_date) &
+                                     snapshots["security_code"].isin(start_securities),
+                                     ["security_code", "pct_weight"]]
+        # Same order as the query, the rows are already sorted by security_code
+        return constituents.sort_values("pct_weight", ascending=False, kind="mergesort").reset_index(drop=True)
+
+    def invalidate(self, index_code: Optional[str] = None):
+        """
+        Drop an index, or all of them, so they are reloaded on the next lookup, e.g. after prices were loaded
+        for securities that had none
+        """
+        with self._lock:
+            for code in ([index_code] if index_code is not None else list(self._snapshots)):
+                self._snapshots.pop(code, None)
+                self._latest_snapshot_dates.pop(code, None)
+                self._checked_at.pop(code, None)
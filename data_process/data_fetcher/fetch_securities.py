@@ -1,6 +1,9 @@
 from data_process.db_connector.mysql_connector import MySqlConnector
+from data_process.data_fetcher.constituents_index import ConstituentsIndex
+from data_process.price_store.local_price_store import LocalPriceStore
+from strategy import tracing
 from datetime import datetime
-from typing import List
+from typing import List, Optional, Dict
 import pandas as pd
 
 
@@ -13,12 +16,18 @@ def fetch_prices(db_conn: MySqlConnector,
     """
     query = """
         SELECT security_code, close_date, adj_close FROM security_prices
-        WHERE security_code in ({}) AND
+        WHERE security_code IN :securities_list AND
         close_date BETWEEN :start_date AND :end_date
-    """.format(str(securities_list).replace("[", "").replace("]", ""))
-    prices_df = db_conn.query_db(query=query, params={"start_date": start_date,
-                                                      "end_date": end_date})
-    return prices_df.set_index(["close_date", "security_code"])["adj_close"].sort_index().unstack("security_code")
+    """
+    with tracing.span("sql_prices", securities=len(securities_list)) as sql_span:
+        prices_df = db_conn.query_db_with_list(query=query,
+                                               list_param="securities_list",
+                                               values=securities_list,
+                                               params={"start_date": start_date,
+                                                       "end_date": end_date})
+        sql_span.set(rows=len(prices_df))
+    with tracing.span("pivot_prices", rows=len(prices_df)):
+        return prices_df.set_index(["close_date", "security_code"])["adj_close"].sort_index().unstack("security_code")
 
 
 def fetch_index_constituents(db_conn: MySqlConnector,
@@ -29,61 +38,200 @@ def fetch_index_constituents(db_conn: MySqlConnector,
     Gets the constituents in the index, that were present on both sim_start_date and sim_end_date.
     Also makes sure the security_codes returned have prices present in yfinance
     """
-    # Get all the constituents that have a price in yfinance, and are active as of a given snapshot_date
+    # Members of the latest snapshot as of sim_end_date that were also in the latest snapshot as of
+    # sim_start_date, and that have a price in yfinance, all in one round trip
     query = """
-        SELECT main.security_code, main.pct_weight FROM index_constituents as main
-        INNER JOIN (
-            -- Making sure we get the security codes as of a given date
-            SELECT MAX(snapshot_date) as max_snapshot_dt, index_code from index_constituents
-            WHERE snapshot_date <= :snapshot_date and index_code = :index_code
-        ) AS prev_snap_dt ON
-            prev_snap_dt.max_snapshot_dt = main.snapshot_date AND
-            prev_snap_dt.index_code = main.index_code
-        INNER JOIN (
-            -- Making sure we only get security codes for which prices exist
-            SELECT DISTINCT (security_code) as security_code from security_prices
-         ) AS prices ON main.security_code = prices.security_code
-        ORDER BY security_code
-    """
-    constituents_at_start = db_conn.query_db(query=query, params={"snapshot_date": sim_start_date,
-                                                                  "index_code": index_code})
-    constituents_at_end = db_conn.query_db(query=query, params={"snapshot_date": sim_end_date,
-                                                                "index_code": index_code})
-    # These securities were in the index for the full period and we only do analysis on them
-    common_securities_for_the_whole_period = set(constituents_at_start["security_code"]).intersection(
-        set(constituents_at_end["security_code"]))
-    filtered_constituents = constituents_at_end[
-        constituents_at_end["security_code"].isin(common_securities_for_the_whole_period)].sort_values("pct_weight",
-                                                                                                       ascending=False)
-    return filtered_constituents
+        SELECT end_snap.security_code, end_snap.pct_weight FROM index_constituents AS end_snap
+        INNER JOIN index_constituents AS start_snap ON
+            start_snap.index_code = end_snap.index_code AND
+            start_snap.security_code = end_snap.security_code AND
+            start_snap.snapshot_date = (
+                SELECT MAX(snapshot_date) FROM index_constituents
+                WHERE snapshot_date <= :sim_start_date AND index_code = :index_code
+            )
+        WHERE end_snap.index_code = :index_code AND
+            end_snap.snapshot_date = (
+                SELECT MAX(snapshot_date) FROM index_constituents
+                WHERE snapshot_date <= :sim_end_date AND index_code = :index_code
+            ) AND
+            -- Making sure we only get security codes for which prices exist, this stops at the first price found
+            -- instead of scanning the whole prices table
+            EXISTS (SELECT 1 FROM security_prices WHERE security_prices.security_code = end_snap.security_code)
+        ORDER BY end_snap.pct_weight DESC, end_snap.security_code
+    """
+    return db_conn.query_db(query=query, params={"sim_start_date": sim_start_date,
+                                                 "sim_end_date": sim_end_date,
+                                                 "index_code": index_code})
+
 
 def fetch_indices(db_conn: MySqlConnector):
     """
-    Get index details, along with the earliest available snapshot date of that index
+    Get index details, along with the earliest and latest available snapshot dates of that index
     """
     query = """
-        SELECT index_details.*, min_snapshot_date FROM index_details
+        SELECT index_details.*, min_snapshot_date, max_snapshot_date FROM index_details
         INNER JOIN (
-            SELECT MIN(snapshot_date) as min_snapshot_date, index_code from index_constituents group by index_code
+            SELECT MIN(snapshot_date) as min_snapshot_date, MAX(snapshot_date) as max_snapshot_date, index_code
+            FROM index_constituents group by index_code
         ) as ic on index_details.index_code = ic.index_code
     """
     return db_conn.query_db(query=query)
 
 
+def fetch_new_prices(db_conn: MySqlConnector,
+                     watermarks: Dict[str, Optional[datetime]],
+                     default_start_date: datetime,
+                     end_date: datetime) -> pd.DataFrame:
+    """
+    Get only the prices after each security's watermark. Securities sharing a watermark are fetched together,
+    which is usually all of them on a daily refresh
+    :param watermarks: Last close_date already known per security, None if nothing is known
+    :param default_start_date: Where to start for securities without a watermark
+    :param end_date: Last close_date to fetch
+    :return: Wide close_date x security_code prices of the new rows only
+    """
+    securities_per_start_date = {}
+    for sec, watermark in watermarks.items():
+        start_date = default_start_date if watermark is None else pd.Timestamp(watermark) + pd.Timedelta(days=1)
+        securities_per_start_date.setdefault(pd.Timestamp(start_date), []).append(sec)
+
+    new_prices = []
+    for start_date, securities_list in sorted(securities_per_start_date.items()):
+        if start_date > pd.Timestamp(end_date):
+            continue
+        fetched_prices = fetch_prices(db_conn=db_conn,
+                                      securities_list=securities_list,
+                                      start_date=start_date,
+                                      end_date=end_date)
+        fetched_prices.index = pd.to_datetime(fetched_prices.index)
+        new_prices.append(fetched_prices)
+    if not new_prices:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="close_date"),
+                            columns=pd.Index([], name="security_code"),
+                            dtype=float)
+    return pd.concat(new_prices, axis=1).sort_index()
+
+
+def sync_price_store(db_conn: MySqlConnector,
+                     price_store: LocalPriceStore,
+                     securities_list: List[str],
+                     start_date: datetime,
+                     end_date: datetime):
+    """
+    Pull prices from security_prices into the local price store, so that it covers the given securities and
+    dates. Only what is missing is fetched: the full synced range for new securities, the extra history for the
+    securities already in the store, and anything after their watermarks. Callers running concurrently with other
+    processes must hold price_store.lock()
+    """
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    prices, dates, _ = price_store.load()
+    stored_securities = price_store.securities
+    stored_prices = pd.DataFrame(prices, index=dates, columns=stored_securities)
+    stored_start, stored_end = price_store.synced_range
+    synced_start = start_date if stored_start is None else min(stored_start, start_date)
+    synced_end = end_date if stored_end is None else max(stored_end, end_date)
+
+    fetched_prices = []
+    new_securities = sorted(set(securities_list) - set(stored_securities))
+    if new_securities:
+        fetched_prices.append(fetch_prices(db_conn=db_conn,
+                                           securities_list=new_securities,
+                                           start_date=synced_start,
+                                           end_date=synced_end))
+    if stored_securities and start_date < stored_start:
+        fetched_prices.append(fetch_prices(db_conn=db_conn,
+                                           securities_list=stored_securities,
+                                           start_date=start_date,
+                                           end_date=stored_start))
+    if stored_securities and end_date > stored_end:
+        fetched_prices.append(fetch_new_prices(db_conn=db_conn,
+                                               watermarks=price_store.watermarks(),
+                                               default_start_date=stored_start,
+                                               end_date=end_date))
+
+    merged_prices = stored_prices
+    for prices_df in fetched_prices:
+        prices_df.index = pd.to_datetime(prices_df.index)
+        # Freshly fetched prices win over the stored ones
+        merged_prices = prices_df.combine_first(merged_prices)
+    merged_prices.index.name = "close_date"
+    merged_prices.columns.name = "security_code"
+    if merged_prices.shape == stored_prices.shape and merged_prices.reindex(
+            index=stored_prices.index, columns=stored_prices.columns).equals(stored_prices):
+        # Nothing new was fetched, e.g. today's prices are not loaded yet, so the store is not rewritten
+        return
+    # Only the dates actually fetched count as synced, e.g. today's prices may not be loaded yet, so that later
+    # requests fetch the rows added after this sync
+    last_fetched_date = merged_prices.dropna(how="all").index.max()
+    if not pd.isnull(last_fetched_date):
+        synced_end = min(synced_end, last_fetched_date)
+    else:
+        synced_end = synced_start - pd.Timedelta(days=1)
+    price_store.write(prices_df=merged_prices, synced_start=synced_start, synced_end=synced_end)
+
+
+def _store_covers(price_store: LocalPriceStore,
+                  securities_list: List[str],
+                  start_date: datetime,
+                  end_date: datetime) -> bool:
+    synced_start, synced_end = price_store.synced_range
+    return not (synced_start is None or set(securities_list) - set(price_store.securities)
+                or pd.Timestamp(start_date) < synced_start or pd.Timestamp(end_date) > synced_end)
+
+
+def fetch_prices_from_store(db_conn: MySqlConnector,
+                            price_store: LocalPriceStore,
+                            securities_list: List[str],
+                            start_date: datetime,
+                            end_date: datetime) -> pd.DataFrame:
+    """
+    Same as fetch_prices, but served from the local price store. The DB is only queried when the store does
+    not cover the securities or the dates asked for yet
+    """
+    if not _store_covers(price_store=price_store, securities_list=securities_list,
+                         start_date=start_date, end_date=end_date):
+        with price_store.lock():
+            # Another process may have synced what is needed while this one was waiting for the lock
+            if not _store_covers(price_store=price_store, securities_list=securities_list,
+                                 start_date=start_date, end_date=end_date):
+                sync_price_store(db_conn=db_conn,
+                                 price_store=price_store,
+                                 securities_list=securities_list,
+                                 start_date=start_date,
+                                 end_date=end_date)
+    return price_store.read(start_date=start_date, end_date=end_date, securities_list=securities_list)
+
+
 def get_all_data(db_conn: MySqlConnector,
                  sim_start_date: datetime,
                  sim_end_date: datetime,
-                 index_code: str):
-    constituents = fetch_index_constituents(db_conn=db_conn,
-                                            sim_start_date=sim_start_date,
-                                            sim_end_date=sim_end_date,
-                                            index_code=index_code)
+                 index_code: str,
+                 price_store: Optional[LocalPriceStore] = None,
+                 constituents_index: Optional[ConstituentsIndex] = None):
+    """
+    :param price_store: If given, prices are read from the local price store instead of the DB
+    :param constituents_index: If given, the constituents are resolved from it instead of the DB
+    """
+    with tracing.span("constituents", cached=constituents_index is not None) as constituents_span:
+        if constituents_index is not None:
+            constituents = constituents_index.get_constituents(index_code=index_code,
+                                                               sim_start_date=sim_start_date,
+                                                               sim_end_date=sim_end_date)
+        else:
+            constituents = fetch_index_constituents(db_conn=db_conn,
+                                                    sim_start_date=sim_start_date,
+                                                    sim_end_date=sim_end_date,
+                                                    index_code=index_code)
+        constituents_span.set(rows=len(constituents))
+    if price_store is not None:
+        return fetch_prices_from_store(db_conn=db_conn,
+                                       price_store=price_store,
+                                       securities_list=list(constituents["security_code"]),
+                                       start_date=sim_start_date,
+                                       end_date=sim_end_date)
     prices = fetch_prices(db_conn=db_conn,
                           securities_list=list(constituents["security_code"]),
                           start_date=sim_start_date,
                           end_date=sim_end_date)
     prices.index = pd.to_datetime(prices.index)
     return prices
-
-
-
@@ -0,0 +1,81 @@
+import os
+import pandas as pd
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Iterable
+from data_process.db_connector.mysql_connector import MySqlConnector
+from data_process.data_fetcher import fetch_securities
+from data_process.price_store.local_price_store import LocalPriceStore
+from strategy.pairs_selection import PAIR_SECURITY_SEPARATOR
+
+
+class IncrementalPriceLoader:
+    """
+    Daily refresh of the local price store. Only the rows after each security's watermark (its last known
+    close_date) are pulled from security_prices, so the DB work is proportional to the new rows
+    """
+
+    def __init__(self, db_conn: MySqlConnector, price_store: LocalPriceStore):
+        self.db_conn = db_conn
+        self.price_store = price_store
+
+    def sync(self, end_date: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        Append the new prices of every security in the store
+        :param end_date: Last close_date to fetch, defaults to today
+        :return: Number of prices added, the securities that got new prices and the watermarks after the sync
+        """
+        end_date = pd.Timestamp.today().normalize() if end_date is None else pd.Timestamp(end_date)
+        # Held until the new version is written, so that the syncs of the web jobs are not overwritten
+        with self.price_store.lock():
+            return self._sync(end_date=end_date)
+
+    def _sync(self, end_date: pd.Timestamp) -> Dict[str, Any]:
+        synced_start, synced_end = self.price_store.synced_range
+        if synced_start is None:
+            # Nothing to refresh yet, the store gets filled by fetch_securities.sync_price_store
+            return {"rows_added": 0, "updated_securities": [], "watermarks": {}}
+
+        new_prices = fetch_securities.fetch_new_prices(db_conn=self.db_conn,
+                                                       watermarks=self.price_store.watermarks(),
+                                                       default_start_date=synced_start,
+                                                       end_date=end_date)
+        has_new_price = new_prices.notna()
+        rows_added = int(has_new_price.to_numpy().sum())
+        updated_securities = sorted(new_prices.columns[has_new_price.any(axis=0)])
+
+        if rows_added:
+            prices, dates, _ = self.price_store.load()
+            stored_prices = pd.DataFrame(prices, index=dates, columns=self.price_store.securities)
+            merged_prices = new_prices.combine_first(stored_prices)
+            merged_prices.index.name = "close_date"
+            merged_prices.columns.name = "security_code"
+            # Only the dates actually fetched count as synced, prices loaded later on are fetched by the next sync
+            last_fetched_date = merged_prices.dropna(how="all").index.max()
+            self.price_store.write(prices_df=merged_prices,
+                                   synced_start=synced_start,
+                                   synced_end=max(synced_end, min(end_date, last_fetched_date)))
+        return {"rows_added": rows_added,
+                "updated_securities": updated_securities,
+                "watermarks": self.price_store.watermarks()}
+
+    @staticmethod
+    def find_stale_pairs(pairs: Iterable[str], updated_securities: Iterable[str]) -> List[str]:
+        """
+        :param pairs: Pairs with cached scores, e.g. the index of generate_pairs_and_scores' output
+        :param updated_securities: Output of sync
+        :return: Pairs whose scores were generated without the latest prices of one of their securities
+        """
+        updated_securities = set(updated_securities)
+        return [pair for pair in pairs if updated_securities.intersection(pair.split(PAIR_SECURITY_SEPARATOR))]
+
+
+## RUN
+if __name__ == "__main__":
+    root_dir_path = Path(__file__).resolve().parents[2]
+    loader = IncrementalPriceLoader(
+        db_conn=MySqlConnector(conn_json_path=os.path.join(root_dir_path, "db_conn_details.json")),
+        price_store=LocalPriceStore(root_dir=os.environ.get("PRICE_STORE_DIR",
+                                                            os.path.join(root_dir_path, "cache", "price_store"))))
+    sync_report = loader.sync()
+    print(f"Added {sync_report['rows_added']} prices for {len(sync_report['updated_securities'])} securities")
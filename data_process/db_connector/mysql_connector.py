@@ -1,23 +1,60 @@
 import pandas as pd
 from sqlalchemy import create_engine, engine
-from sqlalchemy.sql import text
-from typing import Dict
+from sqlalchemy.sql import text, bindparam
+from typing import Dict, List, Any
 import json
+import os
+import weakref
+
+# Large IN lists are split into several queries of at most this many values
+DEFAULT_IN_LIST_CHUNK_SIZE = 1000
+
+# Engines of all the live connectors, forgotten once their connector is garbage collected
+_engines = weakref.WeakSet()
+
+
+def _dispose_engines_in_child():
+    """
+    Pooled connections can not be shared with forked processes, e.g. the background jobs of the webapp, so a child
+    process starts with empty pools of its own. The parent's connections are left open for the parent
+    """
+    for db_engine in list(_engines):
+        db_engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_dispose_engines_in_child)
 
 
 class MySqlConnector:
 
-    def __init__(self, conn_json_path: str, **kwargs):
+    def __init__(self,
+                 conn_json_path: str,
+                 pool_size: int = 5,
+                 max_overflow: int = 5,
+                 pool_recycle: int = 3600,
+                 pool_pre_ping: bool = True,
+                 **kwargs):
         """
+        The pool is per process, the defaults allow 4 gunicorn gevent workers to run up to 10 queries each at
+        once while keeping the total number of connections to the DB at 40
         :param conn_json_path: Path to json containing connection details should include
                                ["username", "password", "host", "port", "db_name"]
+        :param pool_size: Number of connections kept open
+        :param max_overflow: Extra connections that can be opened when all the pooled ones are in use
+        :param pool_recycle: Seconds after which a connection is replaced, to avoid the server timing it out
+        :param pool_pre_ping: Check a connection is alive before using it
         :param kwargs: Any other args
         """
         conn_details = self._parse_credentials_from_json(conn_json_path=conn_json_path)
         self.engine = create_engine("mysql://{username}:{password}@{host}:{port}/{db_name}".format(**conn_details),
                                     # Adding the below to get what was successfully updated when update/insert query is run
                                     connect_args={'client_flag': 0},
+                                    pool_size=pool_size,
+                                    max_overflow=max_overflow,
+                                    pool_recycle=pool_recycle,
+                                    pool_pre_ping=pool_pre_ping,
                                     **kwargs)
+        _engines.add(self.engine)
 
     def _parse_credentials_from_json(self, conn_json_path: str) -> Dict[str, str]:
         """
@@ -32,14 +69,54 @@ class MySqlConnector:
             raise ValueError(f"Please provide all details. Missing {missing_properties}")
         return conn_details
 
+    def _prepare_params(self, params: dict) -> dict:
+        """
+        Hook to adapt param values to the DB driver
+        """
+        return {name: list(value) if isinstance(value, (list, tuple, set)) else value
+                for name, value in (params or {}).items()}
+
+    def _prepare_query(self, query: str, params: dict):
+        """
+        List params are bound as expanding params, e.g. `security_code IN :securities_list`, so the statement
+        stays the same whatever the number of values
+        """
+        list_params = [bindparam(name, expanding=True) for name, value in params.items() if isinstance(value, list)]
+        return text(query).bindparams(*list_params)
+
     def query_db(self, query: str, params: dict = None, **kwargs) -> pd.DataFrame:
         """
         :param query: Select query
-        :param params: Any query params
+        :param params: Any query params, lists are bound as expanding params
         :param kwargs: Any additional args
         :return: Query results
         """
-        return pd.read_sql(sql=text(query),
+        params = self._prepare_params(params)
+        return pd.read_sql(sql=self._prepare_query(query=query, params=params),
                            params=params,
                            con=self.engine,
-                           **kwargs)
\ No newline at end of file
+                           **kwargs)
+
+    def query_db_with_list(self,
+                           query: str,
+                           list_param: str,
+                           values: List[Any],
+                           params: dict = None,
+                           chunk_size: int = DEFAULT_IN_LIST_CHUNK_SIZE,
+                           **kwargs) -> pd.DataFrame:
+        """
+        Run a query with a large IN list, split into several queries of at most chunk_size values
+        :param query: Select query, e.g. with `security_code IN :securities_list`
+        :param list_param: Name of the param holding the list
+        :param values: Values of the list
+        :param params: Any other query params
+        :param chunk_size: Max values per query
+        :param kwargs: Any additional args
+        :return: Query results of all the chunks
+        """
+        values = list(values)
+        results = [self.query_db(query=query,
+                                 params={**(params or {}), list_param: values[start:start + chunk_size]},
+                                 **kwargs)
+                   for start in range(0, max(len(values), 1), chunk_size)]
+        return pd.concat(results, ignore_index=True) if len(results) > 1 else results[0]
@@ -0,0 +1,44 @@
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+from data_process.db_connector.mysql_connector import MySqlConnector
+
+
+class SqliteConnector(MySqlConnector):
+    """
+    SQLite backed stand in for MySqlConnector with the same tables, to run the app, benchmarks or tests locally
+    without a MySQL server. Dates are stored as YYYY-MM-DD text
+    """
+
+    def __init__(self, db_path: str = ":memory:", **kwargs):
+        """
+        :param db_path: Path to the SQLite file, in memory by default
+        :param kwargs: Any other args
+        """
+        if db_path == ":memory:":
+            # A single shared connection, otherwise every connection would get its own empty DB
+            kwargs = {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}, **kwargs}
+        self.engine = create_engine(f"sqlite:///{db_path}", **kwargs)
+
+    def _prepare_params(self, params: dict) -> dict:
+        params = super()._prepare_params(params)
+        return {name: self._to_sqlite_date(value) if isinstance(value, datetime) else value
+                for name, value in params.items()}
+
+    @staticmethod
+    def _to_sqlite_date(value: datetime) -> str:
+        value = pd.Timestamp(value)
+        return value.strftime("%Y-%m-%d") if value == value.normalize() else value.strftime("%Y-%m-%d %H:%M:%S")
+
+    def insert_df(self, table_name: str, inp_df: pd.DataFrame):
+        """
+        Append a df to a table, creating it if needed
+        :param table_name: Table to insert into, e.g. security_prices
+        :param inp_df: Rows to insert, datetime columns are stored as YYYY-MM-DD text
+        """
+        inp_df = inp_df.copy()
+        for col in inp_df.columns:
+            if pd.api.types.is_datetime64_any_dtype(inp_df[col]):
+                inp_df[col] = inp_df[col].dt.strftime("%Y-%m-%d")
+        inp_df.to_sql(table_name, con=self.engine, index=False, if_exists="append")
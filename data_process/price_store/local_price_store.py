@@ -0,0 +1,166 @@
+import fcntl
+import json
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List, Optional, Tuple, Dict, Any
+
+CURRENT_VERSION_FILE = "CURRENT"
+LOCK_FILE = ".lock"
+
+
+class LocalPriceStore:
+    """
+    Local copy of security_prices as a wide close_date x security_code float64 matrix, stored column major in a
+    .npy file and memory mapped on read. Every write goes into a new version directory and CURRENT is switched
+    to it atomically, so readers in other processes never see a half written store
+    """
+
+    def __init__(self, root_dir: str, versions_to_keep: int = 2):
+        """
+        :param root_dir: Directory holding the store, created if it does not exist
+        :param versions_to_keep: How many old versions are kept around for readers still using them
+        """
+        self.root_dir = root_dir
+        self.versions_to_keep = versions_to_keep
+        os.makedirs(root_dir, exist_ok=True)
+        self._loaded_version = None
+        self._loaded = None
+
+    def _current_version(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.root_dir, CURRENT_VERSION_FILE), "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    def load(self) -> Tuple[np.ndarray, pd.DatetimeIndex, Dict[str, Any]]:
+        """
+        :return: Memory mapped prices matrix, its dates and the store metadata (securities in column order and
+                 the date range synced from the DB). Empty if nothing was stored yet
+        """
+        version = self._current_version()
+        if version is None:
+            return np.empty((0, 0)), pd.DatetimeIndex([], name="close_date"), {"securities": [],
+                                                                                "synced_start": None,
+                                                                                "synced_end": None}
+        if version != self._loaded_version:
+            version_dir = os.path.join(self.root_dir, version)
+            prices = np.load(os.path.join(version_dir, "prices.npy"), mmap_mode="r")
+            dates = pd.DatetimeIndex(np.load(os.path.join(version_dir, "dates.npy")), name="close_date")
+            with open(os.path.join(version_dir, "metadata.json"), "r") as f:
+                metadata = json.load(f)
+            self._loaded = (prices, dates, metadata)
+            self._loaded_version = version
+        return self._loaded
+
+    @property
+    def securities(self) -> List[str]:
+        return self.load()[2]["securities"]
+
+    @property
+    def synced_range(self) -> Tuple[Optional[pd.Timestamp], Optional[pd.Timestamp]]:
+        """
+        :return: Date range that has been synced from the DB for all the securities in the store
+        """
+        metadata = self.load()[2]
+        if metadata["synced_start"] is None:
+            return None, None
+        return pd.Timestamp(metadata["synced_start"]), pd.Timestamp(metadata["synced_end"])
+
+    def watermarks(self) -> Dict[str, Optional[pd.Timestamp]]:
+        """
+        :return: Last close_date with a price per security, None if a security has no prices at all
+        """
+        prices, dates, metadata = self.load()
+        if not len(dates):
+            return {sec: None for sec in metadata["securities"]}
+        has_price = ~np.isnan(prices)
+        # Position of the last price is the first price of the reversed history
+        last_positions = len(dates) - 1 - np.argmax(has_price[::-1], axis=0)
+        return {sec: (dates[last_position] if has_price[:, position].any() else None)
+                for position, (sec, last_position) in enumerate(zip(metadata["securities"], last_positions))}
+
+    def read(self,
+             start_date: datetime,
+             end_date: datetime,
+             securities_list: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Same output as fetch_securities.fetch_prices. The date range and a contiguous run of securities are
+        served as views on the memory mapped file, any other selection of securities is copied
+        :param start_date: First close_date, inclusive
+        :param end_date: Last close_date, inclusive
+        :param securities_list: Securities to read, all of them if not given
+        :return: Prices, read only
+        """
+        prices, dates, metadata = self.load()
+        securities = metadata["securities"]
+        rows = slice(dates.searchsorted(pd.Timestamp(start_date), side="left"),
+                     dates.searchsorted(pd.Timestamp(end_date), side="right"))
+        if securities_list is None:
+            columns = slice(0, len(securities))
+            selected_securities = securities
+        else:
+            missing_securities = set(securities_list) - set(securities)
+            if missing_securities:
+                raise KeyError(f"Securities not in the price store: {sorted(missing_securities)}")
+            positions = {sec: position for position, sec in enumerate(securities)}
+            column_positions = np.array([positions[sec] for sec in securities_list], dtype=int)
+            selected_securities = list(securities_list)
+            if len(column_positions) and np.all(np.diff(column_positions) == 1):
+                columns = slice(column_positions[0], column_positions[-1] + 1)
+            else:
+                columns = column_positions
+        prices_df = pd.DataFrame(prices[rows, columns],
+                                 index=dates[rows],
+                                 columns=pd.Index(selected_securities, name="security_code"),
+                                 copy=False)
+        return prices_df
+
+    @contextmanager
+    def lock(self):
+        """
+        Exclusive lock on the store across processes. Writers hold it from reading the store until their new version
+        is written, so that concurrent syncs do not overwrite each other's securities
+        """
+        with open(os.path.join(self.root_dir, LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write(self, prices_df: pd.DataFrame, synced_start: datetime, synced_end: datetime):
+        """
+        Replace the content of the store, under lock when other processes may write to it too
+        :param prices_df: Wide close_date x security_code prices
+        :param synced_start: Start of the date range synced from the DB for all the securities
+        :param synced_end: End of the date range synced from the DB for all the securities
+        """
+        prices_df = prices_df.sort_index()
+        version = f"v{time.time_ns()}"
+        version_dir = os.path.join(self.root_dir, version)
+        os.makedirs(version_dir)
+        # Column major, so that a security's history and a date range of it are contiguous
+        np.save(os.path.join(version_dir, "prices.npy"), np.asfortranarray(prices_df.to_numpy(dtype=np.float64)))
+        np.save(os.path.join(version_dir, "dates.npy"), pd.to_datetime(prices_df.index).to_numpy(dtype="datetime64[ns]"))
+        with open(os.path.join(version_dir, "metadata.json"), "w") as f:
+            json.dump({"securities": [str(sec) for sec in prices_df.columns],
+                       "synced_start": pd.Timestamp(synced_start).isoformat(),
+                       "synced_end": pd.Timestamp(synced_end).isoformat()}, f)
+
+        current_tmp_path = os.path.join(self.root_dir, f"{CURRENT_VERSION_FILE}.{version}")
+        with open(current_tmp_path, "w") as f:
+            f.write(version)
+        os.replace(current_tmp_path, os.path.join(self.root_dir, CURRENT_VERSION_FILE))
+        self._remove_old_versions()
+
+    def _remove_old_versions(self):
+        versions = sorted(name for name in os.listdir(self.root_dir)
+                          if name.startswith("v") and os.path.isdir(os.path.join(self.root_dir, name)))
+        for version in versions[:-self.versions_to_keep]:
+            shutil.rmtree(os.path.join(self.root_dir, version), ignore_errors=True)
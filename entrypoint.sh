@@ -6,7 +6,11 @@ echo "Running entry point script"
 case "$1" in
 default)
   echo "Running Webapp"
-   gunicorn -b 0.0.0.0:5000 webapp.start_app:server -k gevent --timeout 600 --workers 4
+   gunicorn -b 0.0.0.0:5000 webapp.start_app:server -k gevent --timeout 120 --workers 4
+  ;;
+warmup)
+  echo "Precomputing the default pair scores"
+  python -m webapp.warm_up "${@:2}"
   ;;
 *)
   exec "$@"
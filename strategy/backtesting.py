@@ -1,8 +1,9 @@
 import pandas as pd
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Tuple, Union
 from datetime import datetime
 from strategy.pairs_selection import PAIR_SECURITY_SEPARATOR
+from strategy.metrics import gen_metrics
 
 def gen_pair_spread_dfs(chosen_pairs: List[str],
                         prices_df: pd.DataFrame,
@@ -29,6 +30,105 @@ def gen_pair_spread_dfs(chosen_pairs: List[str],
         pairs_dfs[pair] = df
     return pairs_dfs
 
+def _ffill(values: np.ndarray) -> np.ndarray:
+    """
+    Forward fill NaNs along the last axis
+    """
+    last_valid = np.where(np.isnan(values), 0, np.arange(values.shape[-1]))
+    np.maximum.accumulate(last_valid, axis=-1, out=last_valid)
+    return np.take_along_axis(values, last_valid, axis=-1)
+
+
+def _shift_state(state: np.ndarray, initial_state: bool = False) -> np.ndarray:
+    """
+    State before each bar, given the state after each bar
+    """
+    shifted = np.full_like(state, initial_state)
+    shifted[..., 1:] = state[..., :-1]
+    return shifted
+
+
+def _ffill_state(events: np.ndarray, initial_state: bool = False) -> np.ndarray:
+    """
+    State after each bar, given the bars where it is set (1) or reset (0)
+    """
+    state = _ffill(events)
+    return np.where(np.isnan(state), initial_state, state == 1)
+
+
+def gen_pair_positions(spread: np.ndarray,
+                       rolling_mu: np.ndarray,
+                       rolling_std: np.ndarray,
+                       open_threshold: Union[float, np.ndarray],
+                       close_threshold: Union[float, np.ndarray],
+                       initial_is_long: bool = False,
+                       initial_is_short: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Vectorised long/short/close rules of the strategy for a single pair. Thresholds can be arrays of shape (K, 1)
+    to evaluate K threshold combinations at once
+    :param spread: Spread of the pair per bar
+    :param rolling_mu: Rolling mean of the spread
+    :param rolling_std: Rolling std of the spread
+    :param open_threshold: z-score used to enter trade
+    :param close_threshold: z-score used to exit trade
+    :param initial_is_long: Whether the strategy is long before the first bar
+    :param initial_is_short: Whether the strategy is short before the first bar
+    :return: Position change of sec1 per bar (1 long, -1 short, 0 closed, NaN unchanged), and whether the
+             strategy is long/short after each bar
+    """
+    # Going short on spread means sell sec1 and buy sec2
+    # Going long on spread means buy sec1, and sell sec2
+    open_short = spread > rolling_mu + open_threshold * rolling_std
+    open_long = spread < rolling_mu - open_threshold * rolling_std
+    no_open = ~open_short & ~open_long
+    below_close_short = spread <= rolling_mu + close_threshold * rolling_std
+    above_close_long = spread >= rolling_mu - close_threshold * rolling_std
+
+    # The short flag is only set by opening a short, and reset when nothing is opened and the spread is back
+    # below the close level, so the flag is a forward fill of those events
+    is_short = _ffill_state(np.where(open_short, 1.0, np.where(no_open & below_close_short, 0.0, np.nan)),
+                            initial_state=initial_is_short)
+    close_short = no_open & _shift_state(is_short, initial_state=initial_is_short) & below_close_short
+    # The long flag can only be reset if the short was not closed on the same bar
+    is_long = _ffill_state(np.where(open_long, 1.0, np.where(no_open & ~close_short & above_close_long, 0.0, np.nan)),
+                           initial_state=initial_is_long)
+    close_long = no_open & ~close_short & _shift_state(is_long, initial_state=initial_is_long) & above_close_long
+
+    positions = np.where(open_short, -1.0, np.where(open_long, 1.0, np.where(close_short | close_long, 0.0, np.nan)))
+    return positions, is_long, is_short
+
+
+def gen_security_positions(pairs_spreads: Dict[str, pd.DataFrame],
+                           dates: pd.DatetimeIndex,
+                           open_threshold: Union[float, np.ndarray],
+                           close_threshold: Union[float, np.ndarray]) -> Dict[str, np.ndarray]:
+    """
+    Position changes per security over the given dates, for every threshold combination passed in
+    :param pairs_spreads: Output of gen_pair_spread_dfs
+    :param dates: Dates to trade on
+    :param open_threshold: z-score used to enter trade, scalar or array of shape (K, 1)
+    :param close_threshold: z-score used to exit trade, scalar or array of shape (K, 1)
+    :return: 1 means we are long, -1 means we are short, 0 means we dont hold any pos, NaN means no change.
+             Securities are added in the order they are first traded, a later pair overrides an earlier one
+             on the same day
+    """
+    positions = {}
+    for pair, spread_df in pairs_spreads.items():
+        sec1, sec2 = pair.split(PAIR_SECURITY_SEPARATOR)
+        spread_df = spread_df.loc[dates]
+        sec1_positions, _, _ = gen_pair_positions(spread=spread_df["R"].to_numpy(),
+                                                  rolling_mu=spread_df["rolling_mu"].to_numpy(),
+                                                  rolling_std=spread_df["rolling_std"].to_numpy(),
+                                                  open_threshold=open_threshold,
+                                                  close_threshold=close_threshold)
+        traded = ~np.isnan(sec1_positions)
+        if not traded.any():
+            continue
+        for sec, sec_positions in [(sec1, sec1_positions), (sec2, 0 - sec1_positions)]:
+            positions[sec] = np.where(traded, sec_positions, positions[sec]) if sec in positions else sec_positions
+    return positions
+
+
 def get_performance(chosen_pairs: List[str],
                     prices_df: pd.DataFrame,
                     test_start_date: datetime,
@@ -46,42 +146,16 @@ def get_performance(chosen_pairs: List[str],
     :return: Performance df
     """
     returns_df = prices_df.pct_change().dropna().loc[test_start_date:]
-    # Initialise a positions df, 1 means we are long, -1 means we are short, 0 means we dont hold any pos
-    positions_df = pd.DataFrame(index=returns_df.index)
     # Calculate spreads
     pairs_spreads = gen_pair_spread_dfs(chosen_pairs=chosen_pairs,
                                         prices_df=prices_df,
                                         window_size=window_size)
 
-    for pair, spread_df in pairs_spreads.items():
-        is_long = False
-        is_short = False
-        sec1, sec2 = pair.split(PAIR_SECURITY_SEPARATOR)
-        for dt in returns_df.index:
-            spread_row = spread_df.loc[dt]
-            # Going short on spread means sell sec1 and buy sec2
-            # Going long on spread means buy sec1, and sell sec2
-            if spread_row["R"] > spread_row["rolling_mu"] + open_threshold * spread_row["rolling_std"]:
-                # Go short
-                positions_df.loc[dt, sec1] = -1
-                positions_df.loc[dt, sec2] = 1
-                is_short = True
-            elif spread_row["R"] < spread_row["rolling_mu"] - open_threshold * spread_row["rolling_std"]:
-                # Go long
-                positions_df.loc[dt, sec1] = 1
-                positions_df.loc[dt, sec2] = -1
-                is_long = True
-            elif is_short and spread_row["R"] <= spread_row["rolling_mu"] + close_threshold * spread_row["rolling_std"]:
-                # Close short
-                positions_df.loc[dt, sec1] = 0
-                positions_df.loc[dt, sec2] = 0
-                is_short = False
-            elif is_long and spread_row["R"] >= spread_row["rolling_mu"] - close_threshold * spread_row["rolling_std"]:
-                # Close long
-                positions_df.loc[dt, sec1] = 0
-                positions_df.loc[dt, sec2] = 0
-                is_long = False
-
+    positions = gen_security_positions(pairs_spreads=pairs_spreads,
+                                       dates=returns_df.index,
+                                       open_threshold=open_threshold,
+                                       close_threshold=close_threshold)
+    positions_df = pd.DataFrame(positions, index=returns_df.index)
     positions_df = positions_df.fillna(method="ffill").fillna(0)
     # Shift since we determine today what needs to be done tomorrow
     filtered_returns = (positions_df.shift() * returns_df[positions_df.columns]).sum(axis=1)
@@ -94,54 +168,63 @@ def get_performance(chosen_pairs: List[str],
     performance_df = performance_df/performance_df.iloc[0]
     return performance_df
 
-def _get_sharpe(returns: pd.Series):
-    return np.sqrt(252) * np.nanmean(returns) / np.nanstd(returns)
-
-def _get_max_drawdown(cumu_returns: pd.Series):
-    return np.ptp(cumu_returns)/cumu_returns.max()
+def sweep_performance(chosen_pairs: List[str],
+                      prices_df: pd.DataFrame,
+                      test_start_date: datetime,
+                      grid: Union[pd.DataFrame, List[Tuple[int, float, float]]],
+                      return_equity_curves: bool = False) -> Union[pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """
+    Backtest a grid of strategy parameters in one go. The rolling spread statistics are computed once per
+    window size, and all the thresholds of that window are evaluated together
+    :param chosen_pairs: List of pairs chosen
+    :param prices_df: Raw prices
+    :param test_start_date: from when should the backtest begin
+    :param grid: (window_size, open_threshold, close_threshold) combinations to backtest, either as tuples or
+                 as a df with those columns
+    :param return_equity_curves: Whether to also return the strategy performance of every combination
+    :return: Performance metrics of the strategy per combination (see metrics.gen_metrics), and optionally a df
+             with one performance column per combination
+    """
+    grid_df = pd.DataFrame(grid, columns=["window_size", "open_threshold", "close_threshold"]).reset_index(drop=True)
+    returns_df = prices_df.pct_change().dropna().loc[test_start_date:]
+    equity_curves = np.empty((len(grid_df), len(returns_df)))
+    position_changes = np.empty((len(grid_df), len(returns_df)))
+
+    for window_size, window_grid in grid_df.groupby("window_size", sort=False):
+        pairs_spreads = gen_pair_spread_dfs(chosen_pairs=chosen_pairs,
+                                            prices_df=prices_df,
+                                            window_size=window_size)
+        positions = gen_security_positions(
+            pairs_spreads=pairs_spreads,
+            dates=returns_df.index,
+            open_threshold=window_grid["open_threshold"].to_numpy(dtype=float)[:, None],
+            close_threshold=window_grid["close_threshold"].to_numpy(dtype=float)[:, None])
+        strategy_returns = np.zeros((len(window_grid), len(returns_df)))
+        window_position_changes = np.zeros((len(window_grid), len(returns_df)))
+        for sec, sec_positions in positions.items():
+            held_positions = np.nan_to_num(_ffill(sec_positions))
+            # Shift since we determine today what needs to be done tomorrow
+            strategy_returns[:, 1:] += held_positions[:, :-1] * returns_df[sec].to_numpy()[1:]
+            window_position_changes[:, 1:] += np.abs(np.diff(held_positions[:, :-1], axis=1, prepend=0))
+        cumulative_returns = np.nancumprod(strategy_returns + 1, axis=1)
+        # Normalising
+        equity_curves[window_grid.index] = cumulative_returns / cumulative_returns[:, :1]
+        position_changes[window_grid.index] = window_position_changes
+
+    metrics_df = pd.concat([grid_df, gen_metrics(equity_curves=equity_curves, position_changes=position_changes)],
+                           axis=1)
+    if not return_equity_curves:
+        return metrics_df
+    equity_df = pd.DataFrame(equity_curves.T,
+                             index=returns_df.index,
+                             columns=pd.MultiIndex.from_frame(grid_df))
+    return metrics_df, equity_df
 
 
 def gen_performance_metrics(performance_df: pd.DataFrame) -> pd.DataFrame:
     """
     :param performance_df: Output of get_performance
-    :return: Performance metrics
-    """
-    returns = performance_df.pct_change()
-    metrics = []
-    for strat_type in performance_df.columns:
-        metrics.append({
-            "Type": strat_type,
-            "Sharpe": _get_sharpe(returns[strat_type]),
-            "MDD": _get_max_drawdown(performance_df[strat_type])
-        })
-    return pd.DataFrame(metrics)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    :return: Performance metrics of the strategy and the index, one row per Type
+    """
+    return pd.concat([pd.DataFrame({"Type": performance_df.columns}), gen_metrics(equity_curves=performance_df)],
+                     axis=1)
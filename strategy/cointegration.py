@@ -0,0 +1,123 @@
+import numpy as np
+from typing import Dict, Tuple
+
+
+def build_cointegration_grams(log_prices: np.ndarray, adf_lags: int = 1) -> Dict[str, np.ndarray]:
+    """
+    Build the Gram matrices shared by every Engle-Granger test. The residual of a pair is a linear combination of
+    the demeaned log prices of its two securities, so the sums of squares of any pair's residual regressions are
+    quadratic forms in its hedge ratio over these matrices.
+    The ADF design holds the current price changes of all the securities, followed by their lagged price levels and
+    then their lagged price changes, i.e. column s is the current change of security s, column N + s its lagged level
+    and column (1 + lag) * N + s lag `lag` of its change
+    :param log_prices: Log prices matrix, one column per security
+    :param adf_lags: Number of lagged changes in the ADF regressions
+    :return: Gram matrix of the demeaned log prices, used for the hedge ratios, Gram matrix of the ADF design and the
+             number of observations of the ADF regressions
+    """
+    n_rows = log_prices.shape[0]
+    nobs = n_rows - 1 - adf_lags
+    if nobs <= adf_lags + 2:
+        raise ValueError(f"Not enough observations ({n_rows}) for {adf_lags} ADF lags")
+    # Demeaning the prices is the same as having a constant in the cointegrating regression
+    demeaned = log_prices - log_prices.mean(axis=0)
+    changes = np.diff(demeaned, axis=0)
+    # Row t of the ADF regressions is price change t + adf_lags of the changes array
+    design = np.hstack([changes[adf_lags:], demeaned[adf_lags:n_rows - 1]] +
+                       [changes[adf_lags - lag:n_rows - 1 - lag] for lag in range(1, adf_lags + 1)])
+    return {"price_gram": demeaned.T @ demeaned, "adf_gram": design.T @ design, "nobs": nobs}
+
+
+def gen_hedge_ratios(price_gram: np.ndarray, dependent: np.ndarray, independent: np.ndarray) -> np.ndarray:
+    """
+    Least squares slopes of the log prices of `dependent` on the ones of `independent`, with a constant
+    :param price_gram: Gram matrix of the demeaned log prices, output of build_cointegration_grams
+    :param dependent: Column index of the security regressed for each pair
+    :param independent: Column index of the regressor for each pair
+    :return: Hedge ratio per pair
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return price_gram[dependent, independent] / price_gram[independent, independent]
+
+
+def _residual_grams(adf_gram: np.ndarray,
+                    n_securities: int,
+                    adf_lags: int,
+                    dependent: np.ndarray,
+                    independent: np.ndarray,
+                    hedge_ratios: np.ndarray) -> np.ndarray:
+    """
+    Gram matrix of the ADF design of every pair's residual, out of the shared one. With e = a - b * c for every
+    column of the design, e'f = a'd - b (a'g + c'd) + b^2 c'g
+    :return: Array of shape (pairs, adf_lags + 2, adf_lags + 2)
+    """
+    offsets = np.arange(adf_lags + 2) * n_securities
+    dependent_columns = dependent[:, None] + offsets
+    independent_columns = independent[:, None] + offsets
+    hedge_ratios = hedge_ratios[:, None, None]
+    return (adf_gram[dependent_columns[:, :, None], dependent_columns[:, None, :]]
+            - hedge_ratios * (adf_gram[dependent_columns[:, :, None], independent_columns[:, None, :]] +
+                              adf_gram[independent_columns[:, :, None], dependent_columns[:, None, :]])
+            + hedge_ratios ** 2 * adf_gram[independent_columns[:, :, None], independent_columns[:, None, :]])
+
+
+def _inverse(xtx: np.ndarray) -> np.ndarray:
+    try:
+        return np.linalg.inv(xtx)
+    except np.linalg.LinAlgError:
+        # Happens when a residual is flat, e.g. a security with no price changes
+        return np.linalg.pinv(xtx)
+
+
+def adf_statistics(adf_gram: np.ndarray,
+                   n_securities: int,
+                   nobs: int,
+                   adf_lags: int,
+                   dependent: np.ndarray,
+                   independent: np.ndarray,
+                   hedge_ratios: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Batched ADF test, without constant, on the Engle-Granger residuals of every pair. The regressions are solved from
+    the normal equations taken out of the shared Gram matrix, the residuals are never built
+    :param adf_gram: Gram matrix of the ADF design, output of build_cointegration_grams
+    :param n_securities: Number of securities in the log prices matrix used to build the Gram matrix
+    :param nobs: Number of observations of the ADF regressions, output of build_cointegration_grams
+    :param adf_lags: Number of lagged changes the Gram matrix was built with
+    :param dependent: Column index of the security regressed for each pair
+    :param independent: Column index of the regressor for each pair
+    :param hedge_ratios: Output of gen_hedge_ratios
+    :return: ADF t-statistic per pair, more negative being more stationary, and the mean reversion speed of the
+             residual per bar, i.e. the slope of its change on its lagged level
+    """
+    residual_grams = _residual_grams(adf_gram=adf_gram,
+                                     n_securities=n_securities,
+                                     adf_lags=adf_lags,
+                                     dependent=dependent,
+                                     independent=independent,
+                                     hedge_ratios=hedge_ratios)
+    yty = residual_grams[:, 0, 0]
+    xty = residual_grams[:, 1:, 0]
+    xtx_inverse = _inverse(residual_grams[:, 1:, 1:])
+    coefs = np.einsum("mij,mj->mi", xtx_inverse, xty)
+    ssr = yty - np.einsum("mi,mi->m", xty, coefs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma2 = ssr / (nobs - adf_lags - 1)
+        t_stats = coefs[:, 0] / np.sqrt(sigma2 * xtx_inverse[:, 0, 0])
+        # AR(1) fit of the residual alone, the discrete version of an Ornstein-Uhlenbeck process
+        reversion_speeds = residual_grams[:, 1, 0] / residual_grams[:, 1, 1]
+    return t_stats, reversion_speeds
+
+
+def gen_half_lives(reversion_speeds: np.ndarray) -> np.ndarray:
+    """
+    Half-life of the AR(1) fit of the residual, whose deviation is multiplied by 1 + speed every bar. A speed below
+    -1 overshoots the mean, the deviation flips sign every bar but still shrinks down to a speed of -2, so its half-life
+    is the one of its absolute value. A speed of exactly -1 reverts in a single bar, a half-life of 0
+    :param reversion_speeds: Output of adf_statistics
+    :return: Number of bars for a deviation of the residual to halve, inf when it does not revert, i.e. a speed of 0 and
+             above or of -2 and below
+    """
+    decay = np.abs(1 + reversion_speeds)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        half_lives = -np.log(2) / np.log(decay)
+    return np.where(decay >= 1, np.inf, half_lives)
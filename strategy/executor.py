@@ -0,0 +1,42 @@
+import os
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from typing import Callable, Iterable, Iterator, Optional, Sequence, Any
+
+EXECUTORS = ["serial", "thread", "process"]
+
+
+def runs_in_pool(executor: str, n_workers: Optional[int] = None) -> bool:
+    """
+    :return: Whether imap_tasks runs the tasks in a pool of workers rather than in the calling thread
+    """
+    return executor != "serial" and (n_workers or os.cpu_count()) > 1
+
+
+def imap_tasks(func: Callable,
+               tasks: Sequence[Any],
+               executor: str = "serial",
+               n_workers: Optional[int] = None,
+               initializer: Optional[Callable] = None,
+               initargs: Iterable = ()) -> Iterator[Any]:
+    """
+    Run func over all the tasks with the chosen executor, results are yielded in the same order as the tasks
+    :param func: Function applied to every task. Needs to be picklable for the process executor
+    :param tasks: Inputs of func
+    :param executor: One of [serial, thread, process]
+    :param n_workers: Number of threads/processes, defaults to the number of cores
+    :param initializer: Called once per worker before any task is run, e.g. to attach to shared memory. Only run in
+                        the workers of a pool, see runs_in_pool, never in the calling thread
+    :param initargs: Args for the initializer
+    :return: Results of func per task
+    """
+    if executor not in EXECUTORS:
+        raise ValueError(f"Unexpected value for executor. Please choose one of {EXECUTORS}")
+    if not runs_in_pool(executor=executor, n_workers=n_workers):
+        yield from map(func, tasks)
+        return
+    n_workers = n_workers or os.cpu_count()
+
+    pool_class = ThreadPool if executor == "thread" else Pool
+    with pool_class(n_workers, initializer=initializer, initargs=tuple(initargs)) as pool:
+        yield from pool.imap(func, tasks)
@@ -0,0 +1,67 @@
+import numpy as np
+from typing import Tuple
+
+
+def build_lagged_gram(returns: np.ndarray, maxlag: int = 1) -> Tuple[np.ndarray, int]:
+    """
+    Build the Gram matrix shared by every Granger regression. The design holds the lagged returns of all the
+    securities followed by their current returns, i.e. column (lag - 1) * N + s is lag `lag` of security s
+    and column maxlag * N + s is the current return of security s. Columns are demeaned, which is the same as
+    adding a constant to every regression
+    :param returns: Returns matrix, one column per security
+    :param maxlag: Number of lags used in the regressions
+    :return: Gram matrix and the number of observations used in the regressions
+    """
+    n_rows = returns.shape[0]
+    nobs = n_rows - maxlag
+    if nobs <= 2 * maxlag + 1:
+        raise ValueError(f"Not enough observations ({n_rows}) for maxlag {maxlag}")
+    design = np.hstack([returns[maxlag - lag: n_rows - lag] for lag in range(1, maxlag + 1)] + [returns[maxlag:]])
+    design = design - design.mean(axis=0)
+    return design.T @ design, nobs
+
+
+def _explained_sum_of_squares(xtx: np.ndarray, xty: np.ndarray) -> np.ndarray:
+    """
+    Batched xty' (xtx)^-1 xty, i.e. how much of the sum of squares the regressors explain
+    """
+    try:
+        coefs = np.linalg.solve(xtx, xty[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        # Happens when a security has flat returns, fall back to the pseudo inverse like statsmodels' OLS does
+        coefs = np.einsum("mij,mj->mi", np.linalg.pinv(xtx), xty)
+    return np.einsum("mi,mi->m", xty, coefs)
+
+
+def granger_pvalues(gram: np.ndarray,
+                    n_securities: int,
+                    nobs: int,
+                    maxlag: int,
+                    target: np.ndarray,
+                    cause: np.ndarray) -> np.ndarray:
+    """
+    Batched equivalent of statsmodels' grangercausalitytests(...)[maxlag][0]["ssr_chi2test"] p-value, for
+    whether `cause` Granger-causes `target`. The restricted (own lags) and unrestricted (own and cause lags)
+    regressions are solved from the normal equations taken out of the shared Gram matrix
+    :param gram: Output of build_lagged_gram
+    :param n_securities: Number of securities in the returns matrix used to build the Gram matrix
+    :param nobs: Number of observations used in the regressions, output of build_lagged_gram
+    :param maxlag: Number of lags the Gram matrix was built with
+    :param target: Column index of the Granger follower for each test
+    :param cause: Column index of the Granger leader for each test
+    :return: p-value per test
+    """
+    lag_offsets = np.arange(maxlag) * n_securities
+    regressors = np.concatenate([target[:, None] + lag_offsets, cause[:, None] + lag_offsets], axis=1)
+    current = maxlag * n_securities + target
+
+    xtx = gram[regressors[:, :, None], regressors[:, None, :]]
+    xty = gram[regressors, current[:, None]]
+    yty = gram[current, current]
+    ssr_restricted = yty - _explained_sum_of_squares(xtx[:, :maxlag, :maxlag], xty[:, :maxlag])
+    ssr_unrestricted = yty - _explained_sum_of_squares(xtx, xty)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        chi2_stat = nobs * (ssr_restricted - ssr_unrestricted) / ssr_unrestricted
+    # Imported here as scipy.stats is slow to import and the web workers never run the tests
+    from scipy import stats
+    return stats.chi2.sf(chi2_stat, maxlag)
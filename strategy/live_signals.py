@@ -0,0 +1,164 @@
+import json
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import List, Dict, Union, Optional
+from strategy import backtesting
+from strategy.pairs_selection import PAIR_SECURITY_SEPARATOR
+from strategy.spread_stats import RollingSpreadStats
+
+
+class LiveSignalGenerator:
+    """
+    Streaming version of the trading rules in backtesting.get_performance. Keeps the long/short flags and the
+    rolling spread statistics of every pair between calls, so that each new day of prices only costs O(pairs)
+    regardless of how much history there is
+    """
+
+    def __init__(self,
+                 chosen_pairs: List[str],
+                 window_size: int,
+                 open_threshold: float,
+                 close_threshold: float):
+        """
+        :param chosen_pairs: List of pairs chosen
+        :param window_size: Rolling window size to determine entry/exit points
+        :param open_threshold: z-score used to enter trade
+        :param close_threshold: z-score used to exit trade
+        """
+        self.chosen_pairs = list(chosen_pairs)
+        self.window_size = window_size
+        self.open_threshold = open_threshold
+        self.close_threshold = close_threshold
+        self.pair_states = {pair: {"is_long": False,
+                                   "is_short": False,
+                                   "stats": RollingSpreadStats(window_size=window_size)}
+                            for pair in self.chosen_pairs}
+        # 1 means we are long, -1 means we are short, 0 means we dont hold any pos
+        self.positions: Dict[str, float] = {}
+        self.last_date: Optional[pd.Timestamp] = None
+
+    @classmethod
+    def from_history(cls,
+                     chosen_pairs: List[str],
+                     prices_df: pd.DataFrame,
+                     test_start_date: datetime,
+                     window_size: int,
+                     open_threshold: float,
+                     close_threshold: float) -> "LiveSignalGenerator":
+        """
+        Seed the state so that it matches the end of get_performance run with the same arguments
+        :param chosen_pairs: List of pairs chosen
+        :param prices_df: Raw prices
+        :param test_start_date: from when the strategy started trading
+        :param window_size: Rolling window size to determine entry/exit points
+        :param open_threshold: z-score used to enter trade
+        :param close_threshold: z-score used to exit trade
+        """
+        generator = cls(chosen_pairs=chosen_pairs,
+                        window_size=window_size,
+                        open_threshold=open_threshold,
+                        close_threshold=close_threshold)
+        returns_df = prices_df.pct_change().dropna().loc[test_start_date:]
+        pairs_spreads = backtesting.gen_pair_spread_dfs(chosen_pairs=chosen_pairs,
+                                                        prices_df=prices_df,
+                                                        window_size=window_size)
+        for pair, spread_df in pairs_spreads.items():
+            sec1, sec2 = pair.split(PAIR_SECURITY_SEPARATOR)
+            spread_df = spread_df.loc[returns_df.index]
+            _, is_long, is_short = backtesting.gen_pair_positions(spread=spread_df["R"].to_numpy(),
+                                                                  rolling_mu=spread_df["rolling_mu"].to_numpy(),
+                                                                  rolling_std=spread_df["rolling_std"].to_numpy(),
+                                                                  open_threshold=open_threshold,
+                                                                  close_threshold=close_threshold)
+            pair_state = generator.pair_states[pair]
+            pair_state["stats"] = RollingSpreadStats.from_prices(sec1_prices=prices_df[sec1],
+                                                                 sec2_prices=prices_df[sec2],
+                                                                 window_size=window_size)
+            if len(spread_df):
+                pair_state["is_long"] = bool(is_long[-1])
+                pair_state["is_short"] = bool(is_short[-1])
+
+        positions = backtesting.gen_security_positions(pairs_spreads=pairs_spreads,
+                                                       dates=returns_df.index,
+                                                       open_threshold=open_threshold,
+                                                       close_threshold=close_threshold)
+        for sec, sec_positions in positions.items():
+            traded = sec_positions[~np.isnan(sec_positions)]
+            generator.positions[sec] = float(traded[-1])
+        generator.last_date = prices_df.index[-1] if len(prices_df) else None
+        return generator
+
+    def update(self, date: datetime, prices: Union[pd.Series, Dict[str, float]]) -> Dict[str, float]:
+        """
+        Process the closing prices of a new day
+        :param date: Date of the prices, has to be after the last processed date
+        :param prices: Closing price per security, needs to include every security of the chosen pairs
+        :return: New position of every security whose position changed, to be traded the next day
+        """
+        date = pd.Timestamp(date)
+        if self.last_date is not None and date <= self.last_date:
+            raise ValueError(f"Prices for {date} are not after the last processed date {self.last_date}")
+
+        new_positions = {}
+        for pair, pair_state in self.pair_states.items():
+            sec1, sec2 = pair.split(PAIR_SECURITY_SEPARATOR)
+            spread_row = pair_state["stats"].update(sec1_price=prices[sec1], sec2_price=prices[sec2])
+            sec1_position, is_long, is_short = backtesting.gen_pair_positions(
+                spread=np.array([spread_row["R"]]),
+                rolling_mu=np.array([spread_row["rolling_mu"]]),
+                rolling_std=np.array([spread_row["rolling_std"]]),
+                open_threshold=self.open_threshold,
+                close_threshold=self.close_threshold,
+                initial_is_long=pair_state["is_long"],
+                initial_is_short=pair_state["is_short"])
+            pair_state["is_long"] = bool(is_long[0])
+            pair_state["is_short"] = bool(is_short[0])
+            if not np.isnan(sec1_position[0]):
+                # Same as the backtest, a later pair overrides an earlier one on the same day
+                new_positions[sec1] = float(sec1_position[0])
+                new_positions[sec2] = float(0 - sec1_position[0])
+
+        position_changes = {sec: position for sec, position in new_positions.items()
+                            if self.positions.get(sec, 0.0) != position}
+        self.positions.update(new_positions)
+        self.last_date = date
+        return position_changes
+
+    def save(self, path: str):
+        """
+        Checkpoint the state to a json file
+        """
+        state = {
+            "chosen_pairs": self.chosen_pairs,
+            "window_size": self.window_size,
+            "open_threshold": self.open_threshold,
+            "close_threshold": self.close_threshold,
+            "positions": self.positions,
+            "last_date": None if self.last_date is None else self.last_date.isoformat(),
+            "pair_states": {pair: {"is_long": pair_state["is_long"],
+                                   "is_short": pair_state["is_short"],
+                                   "stats": pair_state["stats"].to_dict()}
+                            for pair, pair_state in self.pair_states.items()},
+        }
+        with open(path, "w") as f:
+            json.dump(state, f)
+
+    @classmethod
+    def load(cls, path: str) -> "LiveSignalGenerator":
+        """
+        Restore a generator checkpointed with save
+        """
+        with open(path, "r") as f:
+            state = json.load(f)
+        generator = cls(chosen_pairs=state["chosen_pairs"],
+                        window_size=state["window_size"],
+                        open_threshold=state["open_threshold"],
+                        close_threshold=state["close_threshold"])
+        generator.positions = state["positions"]
+        generator.last_date = None if state["last_date"] is None else pd.Timestamp(state["last_date"])
+        for pair, pair_state in state["pair_states"].items():
+            generator.pair_states[pair] = {"is_long": pair_state["is_long"],
+                                           "is_short": pair_state["is_short"],
+                                           "stats": RollingSpreadStats.from_dict(pair_state["stats"])}
+        return generator
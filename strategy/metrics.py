@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+from typing import Optional, Union
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+def _gen_period_returns(equity_curves: np.ndarray) -> np.ndarray:
+    """
+    Returns between consecutive bars, shape (K, T - 1)
+    """
+    return equity_curves[:, 1:] / equity_curves[:, :-1] - 1
+
+
+def _get_max_drawdown(equity_curves: np.ndarray) -> np.ndarray:
+    """
+    Largest fall from a running peak, as a fraction of that peak
+    """
+    running_max = np.fmax.accumulate(equity_curves, axis=1)
+    return np.nanmax(1 - equity_curves / running_max, axis=1)
+
+
+def _get_max_drawdown_duration(equity_curves: np.ndarray) -> np.ndarray:
+    """
+    Longest number of bars spent below a previous peak, a drawdown not recovered yet counts up to the last bar
+    """
+    running_max = np.fmax.accumulate(equity_curves, axis=1)
+    bars = np.arange(equity_curves.shape[1])
+    # Last bar at a peak before each bar, the first bar always is one
+    last_peak = np.maximum.accumulate(np.where(equity_curves >= running_max, bars, 0), axis=1)
+    return (bars - last_peak).max(axis=1)
+
+
+def gen_metrics(equity_curves: Union[np.ndarray, pd.DataFrame],
+                position_changes: Optional[np.ndarray] = None,
+                periods_per_year: int = TRADING_DAYS_PER_YEAR) -> pd.DataFrame:
+    """
+    Performance metrics of many equity curves at once, e.g. every combination of a parameter sweep
+    :param equity_curves: Array of shape (K, T) with one curve per row, or (T,) for a single curve. A df is read
+                          with one curve per column, like the output of get_performance
+    :param position_changes: Sum of the absolute position changes of every curve per bar, shape (K, T). Turnover is
+                             only reported when given
+    :param periods_per_year: Number of bars in a year, to annualize
+    :return: One row per curve with its annualized return and volatility, Sharpe, Sortino, max drawdown (MDD), longest
+             drawdown in bars, share of the bars with a non zero return that were positive and annualized turnover
+    """
+    if isinstance(equity_curves, pd.DataFrame):
+        equity_curves = equity_curves.to_numpy(dtype=np.float64).T
+    equity_curves = np.atleast_2d(np.asarray(equity_curves, dtype=np.float64))
+    returns = _gen_period_returns(equity_curves)
+    n_returns = np.sum(~np.isnan(returns), axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_returns = np.nanmean(returns, axis=1)
+        std_returns = np.nanstd(returns, axis=1)
+        downside_deviation = np.sqrt(np.nanmean(np.minimum(returns, 0) ** 2, axis=1))
+        first_values = equity_curves[np.arange(len(equity_curves)), np.argmax(~np.isnan(equity_curves), axis=1)]
+        total_returns = equity_curves[:, -1] / first_values
+        active = ~np.isnan(returns) & (returns != 0)
+        metrics = {
+            "Return": total_returns ** (periods_per_year / n_returns) - 1,
+            "Volatility": std_returns * np.sqrt(periods_per_year),
+            "Sharpe": np.sqrt(periods_per_year) * mean_returns / std_returns,
+            "Sortino": np.sqrt(periods_per_year) * mean_returns / downside_deviation,
+            "MDD": _get_max_drawdown(equity_curves),
+            "MDD duration": _get_max_drawdown_duration(equity_curves),
+            "Hit rate": np.sum(active & (returns > 0), axis=1) / np.sum(active, axis=1),
+        }
+        if position_changes is not None:
+            metrics["Turnover"] = np.nanmean(np.atleast_2d(position_changes), axis=1) * periods_per_year
+    return pd.DataFrame(metrics)
@@ -1,10 +1,29 @@
+import os
+import weakref
 import pandas as pd
 import numpy as np
-from statsmodels.tsa.stattools import grangercausalitytests
-from multiprocessing.pool import ThreadPool
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from functools import partial
+from multiprocessing import shared_memory
 from tqdm.auto import tqdm
+from strategy import cointegration, granger, tracing, executor as executors
+from strategy.score_cache import PairScoreCache
 
 PAIR_SECURITY_SEPARATOR = "|"
+# Number of securities handled per block in the batched scorers, bounds the peak memory to block_size x N
+DEFAULT_BLOCK_SIZE = 128
+# Minimum number of tasks per worker when scoring in parallel, so that the workers finishing first pick up more work
+TASKS_PER_WORKER = 4
+# Bump whenever the scores generated by generate_pairs_and_scores change, so that cached scores are not reused
+SCORING_VERSION = "1"
+# Number of best pairs first checked for clashes at once when selecting the top pairs, doubled for every next chunk
+SELECTION_CHUNK_SIZE = 64
+# Share of the pairs, the ones with the most correlated returns, tested for cointegration. The others get NaN scores
+COINTEGRATION_SCREEN_FRACTION = 0.2
+# Number of lagged changes in the ADF tests of the cointegration scores
+ADF_LAGS = 1
+# Number of pairs whose ADF tests are solved at once, bounds the memory of the batched regressions
+COINTEGRATION_CHUNK_SIZE = 65536
 
 
 def generate_mdm(p1: pd.Series, p2: pd.Series) -> float:
@@ -21,6 +40,57 @@ def generate_mdm(p1: pd.Series, p2: pd.Series) -> float:
     return ((p1_cumu - p2_cumu) ** 2).sum()
 
 
+def _iter_pair_blocks(pair_i: np.ndarray, n_securities: int, block_size: int):
+    """
+    Split the pairs into blocks based on their first security
+    :return: Mask of the pairs whose first security is in the same block of block_size securities
+    """
+    for start in range(0, n_securities, block_size):
+        in_block = (pair_i >= start) & (pair_i < start + block_size)
+        if in_block.any():
+            yield in_block
+
+
+def _cumulative_returns(returns: np.ndarray) -> np.ndarray:
+    cumulative = np.cumprod(returns + 1, axis=0)
+    return cumulative / cumulative[0]
+
+
+def _mdm_block(cumulative: np.ndarray,
+               squared_norms: np.ndarray,
+               block_i: np.ndarray,
+               block_j: np.ndarray) -> np.ndarray:
+    start, stop = block_i.min(), block_i.max() + 1
+    dot_products = cumulative[:, start:stop].T @ cumulative
+    scores = squared_norms[block_i] + squared_norms[block_j] - 2 * dot_products[block_i - start, block_j]
+    # Guard against tiny negative values caused by floating point cancellation
+    return np.maximum(scores, 0)
+
+
+def generate_mdm_scores(returns: np.ndarray,
+                        pair_i: np.ndarray,
+                        pair_j: np.ndarray,
+                        block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """
+    Batched version of generate_mdm, scores all the given pairs at once.
+    Uses ||a - b||^2 = ||a||^2 + ||b||^2 - 2a.b on the normalised cumulative returns, computed block_size rows at a time
+    :param returns: Returns matrix, one column per security
+    :param pair_i: Column index of the first security of each pair
+    :param pair_j: Column index of the second security of each pair
+    :param block_size: How many securities are compared against the whole universe at once
+    :return: Sum of distances per pair
+    """
+    cumulative = _cumulative_returns(returns)
+    squared_norms = np.einsum("ij,ij->j", cumulative, cumulative)
+    scores = np.empty(len(pair_i))
+    for in_block in _iter_pair_blocks(pair_i=pair_i, n_securities=cumulative.shape[1], block_size=block_size):
+        scores[in_block] = _mdm_block(cumulative=cumulative,
+                                      squared_norms=squared_norms,
+                                      block_i=pair_i[in_block],
+                                      block_j=pair_j[in_block])
+    return scores
+
+
 def generate_mfr(p1: pd.Series, p2: pd.Series, index_returns: pd.Series) -> float:
     """
     MFR = abs(b1/b2) - 1 where b1 is the market beta of stock 1, and b2 is the market beta of stock 2
@@ -34,6 +104,28 @@ def generate_mfr(p1: pd.Series, p2: pd.Series, index_returns: pd.Series) -> floa
     return np.abs((beta1 / beta2) - 1)
 
 
+def generate_betas(returns: np.ndarray, index_returns: np.ndarray) -> np.ndarray:
+    """
+    Market beta of every security in a single covariance pass, scaled the same way as generate_mfr
+    :param returns: Returns matrix, one column per security
+    :param index_returns: Returns of the index (used as market in this case)
+    :return: Beta per security
+    """
+    centered_returns = returns - returns.mean(axis=0)
+    centered_index = index_returns - index_returns.mean()
+    covariances = centered_index @ centered_returns / (len(index_returns) - 1)
+    return covariances / np.var(index_returns)
+
+
+def generate_mfr_matrix(betas: np.ndarray) -> np.ndarray:
+    """
+    MFR for every combination of securities at once, as an outer ratio of the betas
+    :param betas: Output of generate_betas
+    :return: Matrix where [i, j] is the MFR of security i against security j
+    """
+    return np.abs(np.divide.outer(betas, betas) - 1)
+
+
 def generate_granger_causality_score(p1: pd.Series, p2: pd.Series) -> float:
     """
     Calculate sum of p values for p1 being Granger follower and p2 being Granger leader, and vice versa
@@ -41,6 +133,8 @@ def generate_granger_causality_score(p1: pd.Series, p2: pd.Series) -> float:
     :param p2: Returns of another security
     :return: Sum of p values for a single representative score
     """
+    # statsmodels is slow to import and only needed by this reference implementation
+    from statsmodels.tsa.stattools import grangercausalitytests
     p12 = pd.DataFrame({"p1": p1, "p2": p2})
     p21 = pd.DataFrame({"p2": p2, "p1": p1})
     g12_pval = grangercausalitytests(p12, maxlag=1, verbose=False)[1][0]['ssr_chi2test'][1]
@@ -48,87 +142,522 @@ def generate_granger_causality_score(p1: pd.Series, p2: pd.Series) -> float:
     return g12_pval + g21_pval
 
 
-def _gen_all_scores(params):
-    pair = params["pair"]
-    p1 = params["p1"]
-    p2 = params["p2"]
-    index = params["index"]
+def _granger_block(gram: np.ndarray,
+                   n_securities: int,
+                   nobs: int,
+                   maxlag: int,
+                   block_i: np.ndarray,
+                   block_j: np.ndarray) -> np.ndarray:
+    # Sum of both directions, p1 following p2 and p2 following p1
+    return (granger.granger_pvalues(gram=gram, n_securities=n_securities, nobs=nobs, maxlag=maxlag,
+                                    target=block_i, cause=block_j) +
+            granger.granger_pvalues(gram=gram, n_securities=n_securities, nobs=nobs, maxlag=maxlag,
+                                    target=block_j, cause=block_i))
+
+
+def generate_granger_scores(returns: np.ndarray,
+                            pair_i: np.ndarray,
+                            pair_j: np.ndarray,
+                            maxlag: int = 1,
+                            block_size: int = DEFAULT_BLOCK_SIZE) -> np.ndarray:
+    """
+    Batched version of generate_granger_causality_score, scores all the given pairs at once
+    :param returns: Returns matrix, one column per security
+    :param pair_i: Column index of the first security of each pair
+    :param pair_j: Column index of the second security of each pair
+    :param maxlag: Number of lags used in the Granger causality tests
+    :param block_size: How many securities are tested against the whole universe at once
+    :return: Sum of p values per pair
+    """
+    n_securities = returns.shape[1]
+    gram, nobs = granger.build_lagged_gram(returns=returns, maxlag=maxlag)
+    scores = np.empty(len(pair_i))
+    for in_block in _iter_pair_blocks(pair_i=pair_i, n_securities=n_securities, block_size=block_size):
+        scores[in_block] = _granger_block(gram=gram, n_securities=n_securities, nobs=nobs, maxlag=maxlag,
+                                          block_i=pair_i[in_block], block_j=pair_j[in_block])
+    return scores
+
+
+def get_scoreable_securities(prices_df: pd.DataFrame) -> List[str]:
+    # The data needs a bit of cleaning as some of these symbols have sneaked in, patching for now
+    return [col for col in prices_df.columns if col != "index" and col not in {"EUR", "USD", "GBP"}]
+
+
+# Shared inputs of the scorers by name, with the inputs they are built from. "returns", "index_returns" and "maxlag"
+# are given to every scoring run, "block_i" and "block_j" to the artifacts built per block of pairs
+ARTIFACTS: Dict[str, Dict[str, Any]] = {}
+# Pair scoring methods by name, lower scores are better. Every scorer scores a block of pairs at once out of the
+# artifacts it requires
+SCORERS: Dict[str, Dict[str, Any]] = {}
+BASE_ARTIFACTS = ("returns", "index_returns", "maxlag")
+BLOCK_ARTIFACTS = ("block_i", "block_j")
+
+
+def register_artifact(name: str, requires: Tuple[str, ...], per_block: bool = False):
+    """
+    Decorator registering how to build a shared scoring input. It is built once per scoring run (and worker
+    process), only when a scorer needs it
+    :param name: Name the scorers require it by
+    :param requires: Artifacts it is built from, passed as keyword arguments
+    :param per_block: Built for every block of pairs instead, shared by all the scorers of the block. For inputs that
+                      are only needed for the pairs of the block, so that the workers do not each build them for all
+                      the pairs
+    """
+    def register(build_func: Callable[..., Any]) -> Callable[..., Any]:
+        ARTIFACTS[name] = {"func": build_func, "requires": tuple(requires), "per_block": per_block}
+        return build_func
+    return register
+
+
+def register_scorer(name: str, requires: Tuple[str, ...], description: str):
+    """
+    Decorator registering a pair scoring method, which then gets generated by generate_pairs_and_scores and offered
+    in the webapp. Its function is given the artifacts it requires as keyword arguments along with block_i and
+    block_j, the column indexes of the pairs to score, and returns one score per pair
+    :param name: Name of the method, also the name of its column in the generated pairs
+    :param requires: Artifacts the scores are computed from
+    :param description: Shown to the users next to the method
+    """
+    def register(score_func: Callable[..., np.ndarray]) -> Callable[..., np.ndarray]:
+        SCORERS[name] = {"func": score_func, "requires": tuple(requires), "description": description}
+        return score_func
+    return register
+
+
+def get_scoring_methods() -> List[str]:
+    return list(SCORERS)
+
+
+def gen_scoring_version(methods: List[str], maxlag: int = 1) -> str:
+    """
+    :param methods: Scoring methods generated
+    :param maxlag: Number of lags used in the Granger causality tests
+    :return: Identifies the scores generated with these settings, cached scores are only reused for the same one
+    """
+    return (f"{SCORING_VERSION}-maxlag{maxlag}-screen{COINTEGRATION_SCREEN_FRACTION}-adflags{ADF_LAGS}-"
+            f"{','.join(methods)}")
+
+
+@register_artifact("cumulative", requires=("returns",))
+def _build_cumulative(returns: np.ndarray) -> np.ndarray:
+    return _cumulative_returns(returns)
+
+
+@register_artifact("squared_norms", requires=("cumulative",))
+def _build_squared_norms(cumulative: np.ndarray) -> np.ndarray:
+    return np.einsum("ij,ij->j", cumulative, cumulative)
+
+
+@register_artifact("betas", requires=("returns", "index_returns"))
+def _build_betas(returns: np.ndarray, index_returns: np.ndarray) -> np.ndarray:
+    # Betas are computed once per security rather than once per pair
+    return generate_betas(returns=returns, index_returns=index_returns)
+
+
+@register_artifact("lagged_gram", requires=("returns", "maxlag"))
+def _build_lagged_gram(returns: np.ndarray, maxlag: int) -> Dict[str, Any]:
+    gram, nobs = granger.build_lagged_gram(returns=returns, maxlag=maxlag)
+    return {"gram": gram, "nobs": nobs, "maxlag": maxlag, "n_securities": returns.shape[1]}
+
+
+@register_scorer("MDM", requires=("cumulative", "squared_norms"),
+                 description="Select pairs where the sum of squared distances between cumulative returns of two "
+                             "stocks is the minimum")
+def _score_mdm(cumulative: np.ndarray, squared_norms: np.ndarray, block_i: np.ndarray, block_j: np.ndarray):
+    return _mdm_block(cumulative=cumulative, squared_norms=squared_norms, block_i=block_i, block_j=block_j)
+
+
+@register_scorer("MFR", requires=("betas",),
+                 description="Select pairs with minimum market factor ratio, an indicator that is the ratio of "
+                             "market betas of the two stocks")
+def _score_mfr(betas: np.ndarray, block_i: np.ndarray, block_j: np.ndarray):
+    return np.abs(betas[block_i] / betas[block_j] - 1)
+
 
-    return {
-        "PAIR": pair,
-        "MDM": generate_mdm(p1=p1,
-                            p2=p2),
-        "MFR": generate_mfr(p1=p1,
-                            p2=p1,
-                            index_returns=index),
-        "G": generate_granger_causality_score(p1=p1,
-                                              p2=p2)
-    }
+@register_scorer("G", requires=("lagged_gram",),
+                 description="Select pairs with minimum sum of p-value of 2 Granger-Causality tests. The test "
+                             "determines whether price of one stock is useful in predicting the price of another")
+def _score_granger(lagged_gram: Dict[str, Any], block_i: np.ndarray, block_j: np.ndarray):
+    return _granger_block(**lagged_gram, block_i=block_i, block_j=block_j)
 
 
-def generate_pairs_and_scores(prices_df: pd.DataFrame) -> pd.DataFrame:
+@register_artifact("cointegration_grams", requires=("cumulative",))
+def _build_cointegration_grams(cumulative: np.ndarray) -> Dict[str, Any]:
+    # The normalised cumulative returns are the prices up to a factor, which the constant of the regressions absorbs
+    grams = cointegration.build_cointegration_grams(log_prices=np.log(cumulative), adf_lags=ADF_LAGS)
+    return {**grams, "n_securities": cumulative.shape[1]}
+
+
+@register_artifact("correlation_screen", requires=("returns",))
+def _build_correlation_screen(returns: np.ndarray) -> Dict[str, Any]:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlations = np.corrcoef(returns, rowvar=False)
+    pair_correlations = correlations[np.triu_indices(len(correlations), k=1)]
+    pair_correlations = pair_correlations[~np.isnan(pair_correlations)]
+    min_correlation = (np.quantile(pair_correlations, 1 - COINTEGRATION_SCREEN_FRACTION)
+                       if len(pair_correlations) else np.inf)
+    return {"correlations": correlations, "min_correlation": min_correlation}
+
+
+@register_artifact("cointegration_block", requires=("cointegration_grams", "correlation_screen", "block_i", "block_j"),
+                   per_block=True)
+def _build_cointegration_block(cointegration_grams: Dict[str, Any],
+                               correlation_screen: Dict[str, Any],
+                               block_i: np.ndarray,
+                               block_j: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Engle-Granger ADF statistic and half-life of the pairs of the block that pass the correlation screen, solved once
+    for both the EG and HL scorers. Both securities are tried as the dependent one, the most stationary residual is kept
+    :return: Scores per pair of the block, NaN if not screened
+    """
+    t_stats = np.full(len(block_i), np.nan)
+    half_lives = np.full(len(block_i), np.nan)
+    screened = np.flatnonzero(correlation_screen["correlations"][block_i, block_j] >=
+                              correlation_screen["min_correlation"])
+    for start in range(0, len(screened), COINTEGRATION_CHUNK_SIZE):
+        chunk = screened[start:start + COINTEGRATION_CHUNK_SIZE]
+        dependent = np.concatenate([block_i[chunk], block_j[chunk]])
+        independent = np.concatenate([block_j[chunk], block_i[chunk]])
+        direction_t_stats, reversion_speeds = cointegration.adf_statistics(
+            adf_gram=cointegration_grams["adf_gram"],
+            n_securities=cointegration_grams["n_securities"],
+            nobs=cointegration_grams["nobs"],
+            adf_lags=ADF_LAGS,
+            dependent=dependent,
+            independent=independent,
+            hedge_ratios=cointegration.gen_hedge_ratios(price_gram=cointegration_grams["price_gram"],
+                                                        dependent=dependent,
+                                                        independent=independent))
+        direction_t_stats = direction_t_stats.reshape(2, -1)
+        # A NaN statistic, e.g. from a flat residual, is never the one kept
+        best_direction = np.argmin(np.where(np.isnan(direction_t_stats), np.inf, direction_t_stats), axis=0)
+        columns = np.arange(len(chunk))
+        t_stats[chunk] = direction_t_stats[best_direction, columns]
+        half_lives[chunk] = cointegration.gen_half_lives(reversion_speeds.reshape(2, -1)[best_direction, columns])
+    return {"t_stats": t_stats, "half_lives": half_lives}
+
+
+@register_scorer("EG", requires=("cointegration_block",),
+                 description="Select pairs whose log prices are the most cointegrated, with the minimum ADF statistic "
+                             "of the residuals of their Engle-Granger regression. Only the pairs with the most "
+                             "correlated returns are tested")
+def _score_cointegration(cointegration_block: Dict[str, np.ndarray], block_i: np.ndarray, block_j: np.ndarray):
+    return cointegration_block["t_stats"]
+
+
+@register_scorer("HL", requires=("cointegration_block",),
+                 description="Select pairs whose spread reverts to its mean the fastest, with the minimum half-life of "
+                             "the residuals of their Engle-Granger regression. Only the pairs with the most "
+                             "correlated returns are tested")
+def _score_half_life(cointegration_block: Dict[str, np.ndarray], block_i: np.ndarray, block_j: np.ndarray):
+    return cointegration_block["half_lives"]
+
+
+def _build_scoring_context(returns: np.ndarray,
+                           index_returns: np.ndarray,
+                           maxlag: int,
+                           methods: List[str]) -> Dict[str, Any]:
+    """
+    Every artifact the given scorers need, each built once per process whatever the number of scorers using it. The
+    ones built per block are left to _score_pair_block, only the artifacts they require are built
+    """
+    context = {"returns": returns, "index_returns": index_returns, "maxlag": maxlag}
+    per_block = set()
+
+    def build(name: str, building: Tuple[str, ...] = ()):
+        if name in context or name in per_block or name in BLOCK_ARTIFACTS:
+            return
+        if name not in ARTIFACTS:
+            raise ValueError(f"Unknown scoring artifact {name}")
+        if name in building:
+            raise ValueError(f"Scoring artifact {name} requires itself")
+        for required in ARTIFACTS[name]["requires"]:
+            build(required, building + (name,))
+        if ARTIFACTS[name]["per_block"] or any(required in per_block or required in BLOCK_ARTIFACTS
+                                               for required in ARTIFACTS[name]["requires"]):
+            per_block.add(name)
+            return
+        context[name] = ARTIFACTS[name]["func"](**{required: context[required]
+                                                   for required in ARTIFACTS[name]["requires"]})
+
+    for method in methods:
+        for name in SCORERS[method]["requires"]:
+            build(name)
+    context["methods"] = list(methods)
+    return context
+
+
+def _score_pair_block(context: Dict[str, Any], block: tuple) -> Dict[str, np.ndarray]:
+    """
+    Score a chunk of pairs
+    :param context: Output of _build_scoring_context
+    :param block: Column indexes of the first and the second security of each pair in the chunk
+    :return: Scores per metric for the chunk
+    """
+    block_i, block_j = block
+    block_context = {**context, "block_i": block_i, "block_j": block_j}
+
+    def build(name: str):
+        # The requirements were checked by _build_scoring_context, everything missing is built per block
+        if name in block_context:
+            return
+        for required in ARTIFACTS[name]["requires"]:
+            build(required)
+        block_context[name] = ARTIFACTS[name]["func"](**{required: block_context[required]
+                                                         for required in ARTIFACTS[name]["requires"]})
+
+    block_scores = {}
+    for method in context["methods"]:
+        for name in SCORERS[method]["requires"]:
+            build(name)
+        block_scores[method] = SCORERS[method]["func"](**{name: block_context[name]
+                                                          for name in SCORERS[method]["requires"]},
+                                                       block_i=block_i,
+                                                       block_j=block_j)
+    return block_scores
+
+
+# Set up once in every worker process by _init_scoring_worker
+_worker_state = {}
+
+
+def _init_scoring_worker(shm_name: str, shape: tuple, maxlag: int, methods: List[str]):
+    """
+    Attach to the shared returns matrix, its last column holds the index returns. Scorers registered outside of
+    this module need to be registered on import in the workers too
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    returns = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    _worker_state["shm"] = shm
+    _worker_state["context"] = _build_scoring_context(returns=returns[:, :-1],
+                                                      index_returns=returns[:, -1],
+                                                      maxlag=maxlag,
+                                                      methods=methods)
+
+
+def _score_pair_block_in_worker(block: tuple) -> Dict[str, np.ndarray]:
+    return _score_pair_block(context=_worker_state["context"], block=block)
+
+
+def generate_pairs_and_scores(prices_df: pd.DataFrame,
+                              block_size: int = DEFAULT_BLOCK_SIZE,
+                              maxlag: int = 1,
+                              executor: str = "serial",
+                              n_workers: Optional[int] = None,
+                              cache: Optional[PairScoreCache] = None,
+                              cache_tag: str = "",
+                              progress_callback: Optional[Callable[[int, int], None]] = None,
+                              methods: Optional[List[str]] = None) -> pd.DataFrame:
     """
     Generate pairs and their metrics of how good they are as pairs
     :param prices_df: Prices dataframe for index and all its constituents
-    :return: Dataframe containing best pairs and their scores
+    :param block_size: Bounds the number of pairs of a task to block_size times the number of securities. The pairs
+                       are split into tasks of equal sizes, at least TASKS_PER_WORKER per worker when in parallel
+    :param maxlag: Number of lags used in the Granger causality tests
+    :param executor: One of [serial, thread, process]. The process executor shares the returns matrix with the
+                     workers through shared memory and only sends them the pair indexes to score
+    :param n_workers: Number of threads/processes, defaults to the number of cores
+    :param cache: If given, scores are read from it when already generated for the same prices, and stored in it
+    :param cache_tag: Name the cached scores are stored under, e.g. the index code
+    :param progress_callback: Called with the number of blocks scored so far and the total number of blocks
+    :param methods: Scoring methods to generate, all the registered ones by default
+    :return: Dataframe containing best pairs and their scores, one column per method
     """
+    methods = get_scoring_methods() if methods is None else list(methods)
+    unknown_methods = [method for method in methods if method not in SCORERS]
+    if unknown_methods:
+        raise ValueError(f"Unknown scoring methods {unknown_methods}. Please choose from {get_scoring_methods()}")
+    scoring_version = gen_scoring_version(methods=methods, maxlag=maxlag)
+    if cache is not None:
+        with tracing.span("score_cache_get") as cache_span:
+            cached_pairs_df = cache.get(index_code=cache_tag, prices_df=prices_df, scoring_version=scoring_version)
+            cache_span.set(hit=cached_pairs_df is not None)
+        if cached_pairs_df is not None:
+            return cached_pairs_df
+
     returns_df = prices_df.pct_change().dropna()
 
-    all_securities = [col for col in prices_df.columns if col != "index"]
-    chosen_pairs = []
-    all_params = []
-
-    for sec1 in all_securities:
-        for sec2 in all_securities:
-            pair12 = f"{sec1}{PAIR_SECURITY_SEPARATOR}{sec2}"
-            pair21 = f"{sec2}{PAIR_SECURITY_SEPARATOR}{sec1}"
-            if (sec1 == sec2) or (pair12 in chosen_pairs) or (pair21 in chosen_pairs):
-                continue
-
-            if {sec1, sec2}.intersection({"EUR", "USD", "GBP"}):
-                # The data needs a bit of cleaning as some of these symbols have sneaked in, patching for now
-                continue
-            chosen_pairs.append(pair12)
-            all_params.append({
-                "pair": pair12,
-                "p1": returns_df[sec1],
-                "p2": returns_df[sec2],
-                "index": returns_df["index"],
-            })
-
-    # Using multithreading for faster processing
-    with ThreadPool(10) as pool:
-        all_metrics = list(tqdm(pool.imap(_gen_all_scores, all_params), total=len(all_params)))
-    pairs_df = pd.DataFrame(all_metrics).set_index("PAIR")
+    all_securities = get_scoreable_securities(prices_df)
+    # Every unordered pair once, sec1 always comes before sec2 in all_securities
+    pair_i, pair_j = np.triu_indices(len(all_securities), k=1)
+    securities = np.array(all_securities, dtype=object)
+    chosen_pairs = list(securities[pair_i] + PAIR_SECURITY_SEPARATOR + securities[pair_j])
+
+    n_pairs = len(pair_i)
+    min_tasks = 1 if executor == "serial" else TASKS_PER_WORKER * (n_workers or os.cpu_count())
+    n_blocks = min(max(-(-n_pairs // (block_size * max(len(all_securities), 1))), min_tasks), n_pairs)
+    # Contiguous runs of pairs, so the pairs of a block share their first securities
+    block_bounds = np.linspace(0, n_pairs, n_blocks + 1).astype(int)
+    block_slices = [slice(start, stop) for start, stop in zip(block_bounds[:-1], block_bounds[1:])]
+    blocks = [(pair_i[block_slice], pair_j[block_slice]) for block_slice in block_slices]
+    # Index returns go in the last column
+    returns = returns_df[all_securities + ["index"]].to_numpy(dtype=np.float64)
+
+    with tracing.span("score_pairs", pairs=len(chosen_pairs), blocks=len(blocks)):
+        shm = None
+        try:
+            # A single process scores in place, the shared memory is only set up for the workers of a pool
+            if executor == "process" and executors.runs_in_pool(executor=executor, n_workers=n_workers):
+                shm = shared_memory.SharedMemory(create=True, size=max(returns.nbytes, 1))
+                np.ndarray(returns.shape, dtype=np.float64, buffer=shm.buf)[:] = returns
+                score_func = _score_pair_block_in_worker
+                worker_kwargs = {"initializer": _init_scoring_worker,
+                                 "initargs": (shm.name, returns.shape, maxlag, methods)}
+            else:
+                context = _build_scoring_context(returns=returns[:, :-1], index_returns=returns[:, -1], maxlag=maxlag,
+                                                 methods=methods)
+                score_func = partial(_score_pair_block, context)
+                worker_kwargs = {}
+
+            block_scores = []
+            for block_score in tqdm(executors.imap_tasks(func=score_func,
+                                                         tasks=blocks,
+                                                         executor=executor,
+                                                         n_workers=n_workers,
+                                                         **worker_kwargs),
+                                    total=len(blocks)):
+                block_scores.append(block_score)
+                if progress_callback is not None:
+                    progress_callback(len(block_scores), len(blocks))
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+    pairs_df = pd.DataFrame({"PAIR": chosen_pairs}, index=range(len(chosen_pairs)))
+    for metric in methods:
+        scores = np.empty(len(chosen_pairs))
+        for block_slice, block_score in zip(block_slices, block_scores):
+            scores[block_slice] = block_score[metric]
+        pairs_df[metric] = scores
+    pairs_df = pairs_df.set_index("PAIR")
+
+    if cache is not None:
+        cache.put(index_code=cache_tag, prices_df=prices_df, scoring_version=scoring_version, pairs_df=pairs_df)
     return pairs_df
 
 
+class PairSelectionIndex:
+    """
+    Pairs stored as integer (i, j) security indexes, with the pair order of every selection method sorted once,
+    so that selecting the top pairs with no security repeated needs neither a sort of the pair table nor any
+    string parsing. Row k of the index is row k of the generated pairs it was built from
+    """
+
+    def __init__(self,
+                 securities: List[str],
+                 pair_i: np.ndarray,
+                 pair_j: np.ndarray,
+                 scores: Dict[str, np.ndarray]):
+        """
+        :param securities: Security of every index used in pair_i and pair_j
+        :param pair_i: Index of the first security of each pair
+        :param pair_j: Index of the second security of each pair
+        :param scores: Score of each pair per selection method, lower is better
+        """
+        self.securities = list(securities)
+        self.pair_i = np.asarray(pair_i, dtype=np.int64)
+        self.pair_j = np.asarray(pair_j, dtype=np.int64)
+        self.scores = {method: np.asarray(method_scores, dtype=np.float64) for method, method_scores in scores.items()}
+        # Pair positions from best to worst per method, sorted on first use
+        self._orders: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def from_pairs_df(cls, generated_pairs_df: pd.DataFrame) -> "PairSelectionIndex":
+        """
+        :param generated_pairs_df: Output of generate_pairs_and_scores, its pairs are only parsed once here
+        """
+        split_pairs = [pair.partition(PAIR_SECURITY_SEPARATOR) for pair in generated_pairs_df.index.tolist()]
+        n_pairs = len(split_pairs)
+        all_codes, securities = pd.factorize(np.array([sec1 for sec1, _, _ in split_pairs] +
+                                                      [sec2 for _, _, sec2 in split_pairs], dtype=object))
+        return cls(securities=list(securities),
+                   pair_i=all_codes[:n_pairs],
+                   pair_j=all_codes[n_pairs:],
+                   scores={method: generated_pairs_df[method].to_numpy() for method in generated_pairs_df.columns})
+
+    def _get_order(self, selection_method: str) -> np.ndarray:
+        if selection_method not in self._orders:
+            # Same order as sort_values, pairs without a score, e.g. not screened, are never selected
+            scores = self.scores[selection_method]
+            order = np.argsort(scores, kind="stable")
+            self._orders[selection_method] = order[:np.count_nonzero(~np.isnan(scores))]
+        return self._orders[selection_method]
+
+    def select_top_n(self, selection_method: str, n: Optional[int] = 5) -> np.ndarray:
+        """
+        Greedily pick the best pairs, skipping the pairs with a security that is already chosen and the pairs with a
+        NaN score
+        :param selection_method: Method whose scores are used
+        :param n: How many to choose, None for as many as the universe allows
+        :return: Positions of the chosen pairs, best first
+        """
+        order = self._get_order(selection_method)
+        n_securities = len(self.securities)
+        max_pairs = n_securities // 2 if n is None else min(n, n_securities // 2)
+        used = np.zeros(n_securities, dtype=bool)
+        chosen = []
+        chunk_size = SELECTION_CHUNK_SIZE
+        for start in range(0, len(order), chunk_size):
+            chunk = order[start:start + chunk_size]
+            # Drop the pairs clashing with what was chosen in the previous chunks before going one by one
+            chunk = chunk[~(used[self.pair_i[chunk]] | used[self.pair_j[chunk]])]
+            for position, sec_i, sec_j in zip(chunk.tolist(), self.pair_i[chunk].tolist(), self.pair_j[chunk].tolist()):
+                if used[sec_i] or used[sec_j]:
+                    # One of the securities is already chosen, so we continue to next
+                    continue
+                used[sec_i] = used[sec_j] = True
+                chosen.append(position)
+                if len(chosen) >= max_pairs:
+                    return np.array(chosen, dtype=np.int64)
+            # Later pairs are more likely to clash, so they are filtered in larger chunks
+            chunk_size *= 2
+        return np.array(chosen, dtype=np.int64)
+
+    def select_top_n_many(self, selection_methods: List[str], n: Optional[int] = 5) -> Dict[str, np.ndarray]:
+        """
+        select_top_n for several methods at once
+        :return: Positions of the chosen pairs per method
+        """
+        return {method: self.select_top_n(selection_method=method, n=n) for method in selection_methods}
+
+
+# Selection index of every generated pairs df selected from, by id of the df. An entry is dropped when its df is
+# garbage collected, before the id can be reused
+_selection_indexes: Dict[int, PairSelectionIndex] = {}
+
+
+def get_selection_index(generated_pairs_df: pd.DataFrame) -> PairSelectionIndex:
+    """
+    Selection index of the generated pairs, built on the first selection from them and then reused for as long as the
+    df lives. The df is not expected to change once generated
+    :param generated_pairs_df: Output of generate_pairs_and_scores
+    :return: Index over all the scoring methods of the df
+    """
+    df_id = id(generated_pairs_df)
+    selection_index = _selection_indexes.get(df_id)
+    if selection_index is None:
+        selection_index = _selection_indexes.setdefault(df_id, PairSelectionIndex.from_pairs_df(generated_pairs_df))
+        weakref.finalize(generated_pairs_df, _selection_indexes.pop, df_id, None)
+    return selection_index
+
+
 def select_top_n_pairs(generated_pairs_df: pd.DataFrame,
                        selection_method: str,
-                       n: int = 5):
+                       n: Optional[int] = 5,
+                       selection_index: Optional[PairSelectionIndex] = None):
     """
     Select top n pairs based on the given method. Makes sure that if a
     security is chosen, it is not repeated again
     :param generated_pairs_df: Output of generate_pairs_and_scores
-    :param selection_method: One of [G, MDM, MFR]
-    :param n: How many to choose
+    :param selection_method: One of the registered scoring methods, e.g. MDM
+    :param n: How many to choose, None for as many as the universe allows
+    :param selection_index: Index built from generated_pairs_df, the one cached by get_selection_index if not given
     :return: Filtered df
     """
-    if selection_method not in ["G", "MDM", "MFR"]:
-        raise ValueError("Unexpected value for selection method. Please choose one of [G, MDM, MFR]")
-
-    chosen_securities = set()
-    chosen_pairs = []
-    top_n_pairs = generated_pairs_df.sort_values(selection_method)
-
-    for pair in top_n_pairs.index:
-        sec1, sec2 = pair.split(PAIR_SECURITY_SEPARATOR)
-        if {sec1, sec2}.intersection(chosen_securities):
-            # One of the securities is already chosen, so we continue to next
-            continue
-        chosen_securities.update([sec1, sec2])
-        chosen_pairs.append(pair)
-        if len(chosen_pairs) >= n:
-            break
+    if selection_method not in SCORERS:
+        raise ValueError(f"Unexpected value for selection method. Please choose one of [{', '.join(SCORERS)}]")
 
-    return top_n_pairs.loc[chosen_pairs]
+    if selection_index is None:
+        selection_index = get_selection_index(generated_pairs_df)
+    return generated_pairs_df.iloc[selection_index.select_top_n(selection_method=selection_method, n=n)]
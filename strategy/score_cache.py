@@ -0,0 +1,141 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import time
+import pandas as pd
+from contextlib import contextmanager
+from typing import List, Optional
+
+
+class PairScoreCache:
+    """
+    Persistent cache of generated pair scores in a local SQLite file. Entries are keyed by the index, the
+    window of prices used, the set of constituents and the scoring version, and carry a hash of the prices
+    they were generated from so that they are invalidated when newer prices land for the same window.
+    Least recently used entries are evicted once the cache grows past max_entries or max_bytes
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 64, max_bytes: int = 2 * 1024 ** 3):
+        """
+        :param db_path: Path to the SQLite file, created if it does not exist
+        :param max_entries: Maximum number of entries kept
+        :param max_bytes: Maximum total size of the cached scores
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pair_scores (
+                    cache_key TEXT PRIMARY KEY,
+                    index_code TEXT,
+                    start_date TEXT,
+                    end_date TEXT,
+                    constituents_hash TEXT,
+                    scoring_version TEXT,
+                    data_version TEXT,
+                    payload BLOB,
+                    size_bytes INTEGER,
+                    last_accessed REAL
+                )
+            """)
+
+    @contextmanager
+    def _connect(self):
+        # Several gunicorn workers can share the file, so wait for locks instead of failing straight away
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _hash(values: List[str]) -> str:
+        return hashlib.sha1("\x1f".join(values).encode()).hexdigest()
+
+    @staticmethod
+    def gen_data_version(prices_df: pd.DataFrame) -> str:
+        """
+        :param prices_df: Prices the scores are generated from
+        :return: Hash of the prices, changes whenever any price in the window changes
+        """
+        row_hashes = pd.util.hash_pandas_object(prices_df, index=True).to_numpy()
+        return hashlib.sha1(row_hashes.tobytes()).hexdigest()
+
+    def gen_cache_key(self, index_code: str, prices_df: pd.DataFrame, scoring_version: str) -> dict:
+        """
+        :param index_code: Index the prices belong to
+        :param prices_df: Prices the scores are generated from
+        :param scoring_version: Version of the scoring code and its parameters
+        :return: Key details of the entry
+        """
+        start_date = str(prices_df.index.min())
+        end_date = str(prices_df.index.max())
+        constituents_hash = self._hash([str(col) for col in prices_df.columns])
+        return {
+            "cache_key": self._hash([index_code, start_date, end_date, constituents_hash, scoring_version]),
+            "index_code": index_code,
+            "start_date": start_date,
+            "end_date": end_date,
+            "constituents_hash": constituents_hash,
+            "scoring_version": scoring_version,
+        }
+
+    def get(self, index_code: str, prices_df: pd.DataFrame, scoring_version: str) -> Optional[pd.DataFrame]:
+        """
+        :return: Cached scores, or None if there are none or they were generated from older prices
+        """
+        key = self.gen_cache_key(index_code=index_code, prices_df=prices_df, scoring_version=scoring_version)
+        with self._connect() as conn:
+            row = conn.execute("SELECT data_version, payload FROM pair_scores WHERE cache_key = ?",
+                               (key["cache_key"],)).fetchone()
+            if row is None:
+                return None
+            if row[0] != self.gen_data_version(prices_df):
+                # Prices changed since the scores were generated
+                conn.execute("DELETE FROM pair_scores WHERE cache_key = ?", (key["cache_key"],))
+                return None
+            conn.execute("UPDATE pair_scores SET last_accessed = ? WHERE cache_key = ?",
+                         (time.time(), key["cache_key"]))
+        return pickle.loads(row[1])
+
+    def put(self, index_code: str, prices_df: pd.DataFrame, scoring_version: str, pairs_df: pd.DataFrame):
+        """
+        Store the scores generated from prices_df and evict the least recently used entries if needed
+        """
+        key = self.gen_cache_key(index_code=index_code, prices_df=prices_df, scoring_version=scoring_version)
+        payload = pickle.dumps(pairs_df, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT OR REPLACE INTO pair_scores
+                (cache_key, index_code, start_date, end_date, constituents_hash, scoring_version, data_version,
+                 payload, size_bytes, last_accessed)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (key["cache_key"], key["index_code"], key["start_date"], key["end_date"],
+                  key["constituents_hash"], key["scoring_version"], self.gen_data_version(prices_df),
+                  payload, len(payload), time.time()))
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        entries = conn.execute("SELECT cache_key, size_bytes FROM pair_scores ORDER BY last_accessed DESC").fetchall()
+        total_bytes = 0
+        to_evict = []
+        for position, (cache_key, size_bytes) in enumerate(entries):
+            total_bytes += size_bytes
+            # Always keep the most recent entry
+            if position and (position >= self.max_entries or total_bytes > self.max_bytes):
+                to_evict.append((cache_key,))
+        conn.executemany("DELETE FROM pair_scores WHERE cache_key = ?", to_evict)
+
+    def invalidate(self, index_code: Optional[str] = None):
+        """
+        Drop the cached scores of an index, or of all the indices if none is given
+        """
+        with self._connect() as conn:
+            if index_code is None:
+                conn.execute("DELETE FROM pair_scores")
+            else:
+                conn.execute("DELETE FROM pair_scores WHERE index_code = ?", (index_code,))
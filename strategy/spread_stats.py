@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Any
+
+
+class RollingSpreadStats:
+    """
+    Incremental version of the spread statistics in backtesting.gen_pair_spread_dfs for a single pair.
+    Keeps the last window_size spreads in a ring buffer and their mean/sum of squared deviations with Welford's
+    algorithm, so every new bar is handled in constant time
+    """
+
+    def __init__(self, window_size: int):
+        """
+        :param window_size: Rolling window size to determine entry/exit points
+        """
+        self.window_size = window_size
+        self._buffer = np.full(window_size, np.nan)
+        self._next_slot = 0
+        self._n_valid = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._updates_since_resync = 0
+        self.spread = np.nan
+
+    @classmethod
+    def from_prices(cls, sec1_prices: pd.Series, sec2_prices: pd.Series, window_size: int) -> "RollingSpreadStats":
+        """
+        Seed the statistics from history, only the last window_size bars are needed
+        :param sec1_prices: Prices of the first security of the pair
+        :param sec2_prices: Prices of the second security of the pair
+        :param window_size: Rolling window size to determine entry/exit points
+        """
+        stats = cls(window_size=window_size)
+        spreads = (sec1_prices / sec2_prices).to_numpy(dtype=float)
+        for spread in spreads[-window_size:]:
+            stats._add_spread(spread)
+        return stats
+
+    def _add_spread(self, spread: float):
+        evicted = self._buffer[self._next_slot]
+        self._buffer[self._next_slot] = spread
+        self._next_slot = (self._next_slot + 1) % self.window_size
+        self.spread = spread
+
+        if not np.isnan(evicted):
+            self._n_valid -= 1
+            if self._n_valid == 0:
+                self._mean, self._m2 = 0.0, 0.0
+            else:
+                delta = evicted - self._mean
+                self._mean -= delta / self._n_valid
+                self._m2 -= delta * (evicted - self._mean)
+        if not np.isnan(spread):
+            self._n_valid += 1
+            delta = spread - self._mean
+            self._mean += delta / self._n_valid
+            self._m2 += delta * (spread - self._mean)
+
+        self._updates_since_resync += 1
+        if self._updates_since_resync >= self.window_size:
+            # Recompute from the buffer once per window to stop rounding errors from building up, still O(1) amortised
+            self._resync()
+
+    def _resync(self):
+        valid = self._buffer[~np.isnan(self._buffer)]
+        self._n_valid = len(valid)
+        self._mean = valid.mean() if len(valid) else 0.0
+        self._m2 = ((valid - self._mean) ** 2).sum() if len(valid) else 0.0
+        self._updates_since_resync = 0
+
+    def update(self, sec1_price: float, sec2_price: float) -> Dict[str, float]:
+        """
+        Add the closing prices of a new bar
+        :param sec1_price: Price of the first security of the pair
+        :param sec2_price: Price of the second security of the pair
+        :return: Spread statistics after the new bar
+        """
+        self._add_spread(np.float64(sec1_price) / np.float64(sec2_price))
+        return self.current()
+
+    def current(self) -> Dict[str, float]:
+        """
+        :return: Latest spread along with its rolling mean and std, same as a row of gen_pair_spread_dfs.
+                 The rolling values are NaN until a full window of valid spreads has been seen
+        """
+        if self._n_valid < self.window_size:
+            rolling_mu, rolling_std = np.nan, np.nan
+        else:
+            rolling_mu = self._mean
+            rolling_std = np.sqrt(max(self._m2, 0.0) / (self._n_valid - 1)) if self._n_valid > 1 else np.nan
+        return {
+            "R": self.spread,
+            "rolling_mu": rolling_mu,
+            "rolling_std": rolling_std
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        :return: JSON serialisable state, to checkpoint the statistics
+        """
+        return {
+            "window_size": self.window_size,
+            "buffer": self._buffer.tolist(),
+            "next_slot": self._next_slot,
+            "spread": float(self.spread),
+        }
+
+    @classmethod
+    def from_dict(cls, state: Dict[str, Any]) -> "RollingSpreadStats":
+        """
+        :param state: Output of to_dict
+        """
+        stats = cls(window_size=state["window_size"])
+        stats._buffer = np.array(state["buffer"], dtype=float)
+        stats._next_slot = state["next_slot"]
+        stats.spread = state["spread"]
+        stats._resync()
+        return stats
@@ -0,0 +1,122 @@
+import os
+import time
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Optional
+
+# Number of finished spans kept in memory when no sink is set
+MAX_SAMPLES = 10000
+
+_state: Dict[str, Any] = {"enabled": os.environ.get("TRACING_ENABLED", "0") == "1", "sink": None}
+_samples = deque(maxlen=MAX_SAMPLES)
+
+
+class Span:
+    """
+    A timed stage, with counts such as rows, pairs or payload bytes attached to it
+    """
+    __slots__ = ("name", "attrs")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs: Any):
+        self.attrs.update(attrs)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs: Any):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def enable(sink: Optional[Callable[[Dict[str, Any]], None]] = None):
+    """
+    Start recording spans
+    :param sink: Gets every finished span, e.g. to share them between processes. They are kept in memory if not set
+    """
+    _state["enabled"] = True
+    _state["sink"] = sink
+
+
+def disable():
+    _state["enabled"] = False
+
+
+def is_enabled() -> bool:
+    return _state["enabled"]
+
+
+@contextmanager
+def span(name: str, **attrs: Any):
+    """
+    Time a stage, e.g.
+        with tracing.span("fetch_prices") as fetch_span:
+            ...
+            fetch_span.set(rows=len(prices_df))
+    Does nothing but yield a no-op span when tracing is disabled
+    :param name: Name of the stage, the spans are aggregated by it
+    :param attrs: Counts known up front
+    """
+    if not _state["enabled"]:
+        yield NOOP_SPAN
+        return
+    current_span = Span(name=name, attrs=attrs)
+    start = time.perf_counter()
+    try:
+        yield current_span
+    finally:
+        sample = {"name": name,
+                  "duration_s": time.perf_counter() - start,
+                  "ended_at": time.time(),
+                  "pid": os.getpid(),
+                  **current_span.attrs}
+        sink = _state["sink"]
+        if sink is None:
+            _samples.append(sample)
+        else:
+            sink(sample)
+
+
+def get_samples() -> list:
+    """
+    :return: Spans kept in memory, oldest first
+    """
+    return list(_samples)
+
+
+def summarize(samples: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    Aggregate the spans per stage
+    :param samples: Finished spans
+    :return: Count, p50, p95 and max duration in ms of every stage, the p50 of its counts and the rate of its flags
+    """
+    samples_per_stage = {}
+    for sample in samples:
+        samples_per_stage.setdefault(sample["name"], []).append(sample)
+
+    summary = {}
+    for name, stage_samples in sorted(samples_per_stage.items()):
+        durations_ms = np.array([sample["duration_s"] for sample in stage_samples]) * 1000
+        stage_summary = {"count": len(stage_samples),
+                         "p50_ms": float(np.percentile(durations_ms, 50)),
+                         "p95_ms": float(np.percentile(durations_ms, 95)),
+                         "max_ms": float(durations_ms.max()),
+                         "total_s": float(durations_ms.sum() / 1000)}
+        attr_names = {attr for sample in stage_samples for attr, value in sample.items()
+                      if attr not in ("name", "duration_s", "ended_at", "pid") and isinstance(value, (int, float))}
+        for attr in sorted(attr_names):
+            values = [sample[attr] for sample in stage_samples if isinstance(sample.get(attr), (int, float))]
+            if all(isinstance(value, bool) for value in values):
+                # e.g. cache hits
+                stage_summary[f"{attr}_rate"] = float(np.mean(values))
+            else:
+                stage_summary[f"{attr}_p50"] = float(np.percentile(values, 50))
+        summary[name] = stage_summary
+    return summary
@@ -0,0 +1,244 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Tuple, Any
+from tqdm.auto import tqdm
+from strategy import backtesting, granger, pairs_selection, executor as executors
+from strategy.pairs_selection import PAIR_SECURITY_SEPARATOR
+
+# Number of pairs scored at once when running the Granger tests of a window
+GRANGER_CHUNK_SIZE = 16384
+# Scoring methods that can be updated incrementally, with the sufficient statistics each of them needs
+WALK_FORWARD_METHODS = {"MDM": ("cumulative_gram",),
+                        "MFR": ("index_cross",),
+                        "G": ("design_gram",)}
+
+
+def _lag_columns(lag: int, maxlag: int, n_securities: int) -> slice:
+    """
+    Columns of a lag in a design laid out as in granger.build_lagged_gram, lag 0 being the current returns
+    """
+    block = maxlag if lag == 0 else lag - 1
+    return slice(block * n_securities, (block + 1) * n_securities)
+
+
+def _gen_block_statistics(cumulative: np.ndarray,
+                          design: Optional[np.ndarray],
+                          index_returns: np.ndarray,
+                          rows: np.ndarray,
+                          statistic_names: Tuple[str, ...]) -> Dict[str, Any]:
+    """
+    Sufficient statistics of the scores over a block of rows, they add up across blocks
+    :param cumulative: Cumulative returns of every security since the start of the data
+    :param design: Lagged and current returns of every security, laid out as in granger.build_lagged_gram. Only
+                   needed by the statistics of MFR and G
+    :param index_returns: Returns of the index
+    :param rows: Rows in the block
+    :param statistic_names: Statistics to compute, the ones the selection method needs
+    """
+    statistics = {"n": len(rows)}
+    if "cumulative_gram" in statistic_names:
+        block_cumulative = cumulative[rows]
+        statistics["cumulative_gram"] = block_cumulative.T @ block_cumulative
+    if design is not None:
+        block_design = design[rows]
+        statistics["design_sum"] = block_design.sum(axis=0)
+        if "design_gram" in statistic_names:
+            statistics["design_gram"] = block_design.T @ block_design
+    if "index_cross" in statistic_names:
+        block_index = index_returns[rows]
+        statistics["index_cross"] = block_design.T @ block_index
+        statistics["index_sum"] = block_index.sum()
+        statistics["index_sq"] = block_index @ block_index
+    return statistics
+
+
+def _add_statistics(total: Optional[Dict[str, Any]], block: Dict[str, Any], sign: int = 1) -> Dict[str, Any]:
+    if total is None:
+        return dict(block)
+    return {key: total[key] + sign * block[key] for key in total}
+
+
+def _score_window(statistics: Dict[str, Any],
+                  first_cumulative: np.ndarray,
+                  selection_method: str,
+                  maxlag: int,
+                  pair_i: np.ndarray,
+                  pair_j: np.ndarray) -> np.ndarray:
+    """
+    Score of every pair with the given method, out of the sufficient statistics of a window
+    :param statistics: Sum of _gen_block_statistics over the blocks in the window
+    :param first_cumulative: Cumulative returns on the first row of the window, used to normalise
+    :param selection_method: One of WALK_FORWARD_METHODS
+    :param maxlag: Number of lags used in the Granger causality tests
+    :param pair_i: Column index of the first security of each pair
+    :param pair_j: Column index of the second security of each pair
+    """
+    n_securities = len(first_cumulative)
+    nobs = statistics["n"]
+
+    if selection_method == "MDM":
+        # Cumulative returns normalised to the start of the window are cumulative / first_cumulative
+        scale = 1 / first_cumulative
+        dot_products = statistics["cumulative_gram"] * np.outer(scale, scale)
+        squared_norms = np.diag(dot_products)
+        return np.maximum(squared_norms[pair_i] + squared_norms[pair_j] - 2 * dot_products[pair_i, pair_j], 0)
+
+    if selection_method == "MFR":
+        current = slice(maxlag * n_securities, (maxlag + 1) * n_securities)
+        means = statistics["design_sum"][current] / nobs
+        index_mean = statistics["index_sum"] / nobs
+        covariances = (statistics["index_cross"][current] - nobs * means * index_mean) / (nobs - 1)
+        index_variance = statistics["index_sq"] / nobs - index_mean ** 2
+        betas = covariances / index_variance
+        return np.abs(betas[pair_i] / betas[pair_j] - 1)
+
+    gram = statistics["design_gram"] - np.outer(statistics["design_sum"], statistics["design_sum"]) / nobs
+    g_scores = np.empty(len(pair_i))
+    for start in range(0, len(pair_i), GRANGER_CHUNK_SIZE):
+        chunk_i = pair_i[start:start + GRANGER_CHUNK_SIZE]
+        chunk_j = pair_j[start:start + GRANGER_CHUNK_SIZE]
+        g_scores[start:start + GRANGER_CHUNK_SIZE] = (
+                granger.granger_pvalues(gram=gram, n_securities=n_securities, nobs=nobs, maxlag=maxlag,
+                                        target=chunk_i, cause=chunk_j) +
+                granger.granger_pvalues(gram=gram, n_securities=n_securities, nobs=nobs, maxlag=maxlag,
+                                        target=chunk_j, cause=chunk_i))
+    return g_scores
+
+
+def _evaluate_window(task: Dict[str, Any]) -> pd.DataFrame:
+    """
+    Out of sample backtest of the pairs chosen for a window
+    """
+    performance_df = backtesting.get_performance(chosen_pairs=task["chosen_pairs"],
+                                                 prices_df=task["prices_df"],
+                                                 test_start_date=task["test_start_date"],
+                                                 window_size=task["window_size"],
+                                                 open_threshold=task["open_threshold"],
+                                                 close_threshold=task["close_threshold"])
+    return performance_df
+
+
+def walk_forward_backtest(prices_df: pd.DataFrame,
+                          train_months: int,
+                          selection_method: str,
+                          rebalance_months: int = 1,
+                          n: int = 5,
+                          window_size: int = 30,
+                          open_threshold: float = 2,
+                          close_threshold: float = 0,
+                          maxlag: int = 1,
+                          executor: str = "serial",
+                          n_workers: Optional[int] = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Walk forward backtest, pairs are re-selected on the last train_months every rebalance_months and traded
+    until the next re-selection. Scores are updated incrementally: the sufficient statistics of every calendar
+    month are added to the window when it enters and subtracted when it leaves, instead of re-scoring the whole
+    window. The lagged regressors of the first day of a window use the day before it
+    :param prices_df: Prices dataframe for index and all its constituents
+    :param train_months: Number of months used to select the pairs
+    :param selection_method: One of WALK_FORWARD_METHODS, only its scores are computed
+    :param rebalance_months: How often the pairs are re-selected
+    :param n: How many pairs to trade
+    :param window_size: Rolling window size to determine entry/exit points
+    :param open_threshold: z-score used to enter trade
+    :param close_threshold: z-score used to exit trade
+    :param maxlag: Number of lags used in the Granger causality tests
+    :param executor: One of [serial, thread, process], used to backtest the windows in parallel
+    :param n_workers: Number of threads/processes, defaults to the number of cores
+    :return: Stitched out of sample performance df of the strategy and the index, and the pairs chosen per window
+    """
+    if selection_method not in pairs_selection.SCORERS:
+        raise ValueError(f"Unexpected value for selection method. Please choose one of "
+                         f"[{', '.join(pairs_selection.SCORERS)}]")
+    if selection_method not in WALK_FORWARD_METHODS:
+        raise ValueError(f"Selection method {selection_method} can not be updated incrementally by the walk forward "
+                         f"backtest. Please choose one of [{', '.join(WALK_FORWARD_METHODS)}]")
+    statistic_names = WALK_FORWARD_METHODS[selection_method]
+
+    returns_df = prices_df.pct_change().dropna()
+    all_securities = pairs_selection.get_scoreable_securities(prices_df)
+    pair_i, pair_j = np.triu_indices(len(all_securities), k=1)
+    securities = np.array(all_securities, dtype=object)
+    all_pairs = list(securities[pair_i] + PAIR_SECURITY_SEPARATOR + securities[pair_j])
+
+    returns = returns_df[all_securities].to_numpy(dtype=float)
+    n_rows = len(returns)
+    cumulative = np.cumprod(returns + 1, axis=0)
+    design = None
+    if selection_method != "MDM":
+        design = np.full((n_rows, (maxlag + 1) * len(all_securities)), np.nan)
+        for lag in range(maxlag + 1):
+            design[lag:, _lag_columns(lag, maxlag, len(all_securities))] = returns[:n_rows - lag]
+    index_returns = returns_df["index"].to_numpy(dtype=float)
+
+    # The first rows do not have all the lags, so they are not part of any block
+    months = returns_df.index.to_period("M")
+    month_rows = {month: rows[rows >= maxlag] for month, rows in
+                  pd.Series(np.arange(n_rows)).groupby(months).groups.items()}
+    all_months = sorted(month_rows)
+
+    statistics = None
+    window_months = set()
+    windows = []
+    tasks = []
+    for start in tqdm(range(0, len(all_months) - train_months, rebalance_months)):
+        train = all_months[start:start + train_months]
+        test = all_months[start + train_months:start + train_months + rebalance_months]
+        if statistics is None or not window_months.intersection(train):
+            statistics, window_months = None, set()
+        for month in window_months.difference(train):
+            statistics = _add_statistics(statistics, _gen_block_statistics(cumulative, design, index_returns,
+                                                                           month_rows[month], statistic_names),
+                                         sign=-1)
+        for month in sorted(set(train).difference(window_months)):
+            statistics = _add_statistics(statistics, _gen_block_statistics(cumulative, design, index_returns,
+                                                                           month_rows[month], statistic_names))
+        window_months = set(train)
+
+        first_row = min(month_rows[month].min() for month in train if len(month_rows[month]))
+        scores = _score_window(statistics=statistics,
+                               first_cumulative=cumulative[first_row],
+                               selection_method=selection_method,
+                               maxlag=maxlag,
+                               pair_i=pair_i,
+                               pair_j=pair_j)
+        selection_index = pairs_selection.PairSelectionIndex(securities=all_securities,
+                                                             pair_i=pair_i,
+                                                             pair_j=pair_j,
+                                                             scores={selection_method: scores})
+        chosen_pairs = [all_pairs[position] for position in
+                        selection_index.select_top_n(selection_method=selection_method, n=n)]
+
+        train_start = returns_df.index[first_row]
+        test_start = returns_df.index[month_rows[test[0]].min()]
+        test_end = returns_df.index[month_rows[test[-1]].max()]
+        chosen_securities = sorted({sec for pair in chosen_pairs for sec in pair.split(PAIR_SECURITY_SEPARATOR)})
+        windows.append({"train_start": train_start,
+                        "test_start": test_start,
+                        "test_end": test_end,
+                        "pairs": chosen_pairs})
+        tasks.append({"chosen_pairs": chosen_pairs,
+                      "prices_df": prices_df.loc[train_start:test_end, chosen_securities + ["index"]],
+                      "test_start_date": test_start,
+                      "window_size": window_size,
+                      "open_threshold": open_threshold,
+                      "close_threshold": close_threshold})
+
+    window_performances = list(executors.imap_tasks(func=_evaluate_window,
+                                                    tasks=tasks,
+                                                    executor=executor,
+                                                    n_workers=n_workers))
+    # Every window starts flat, so its curve is chained on to where the previous window ended
+    strategy_curves = []
+    last_value = 1.0
+    for window_performance in window_performances:
+        strategy_curves.append(window_performance["strategy"] * last_value)
+        last_value = strategy_curves[-1].iloc[-1]
+    strategy = pd.concat(strategy_curves) if strategy_curves else pd.Series(dtype=float)
+    index_curve = pd.Series(np.nancumprod(returns_df["index"].loc[strategy.index] + 1), index=strategy.index)
+    performance_df = pd.DataFrame({"index": index_curve, "strategy": strategy})
+    if len(performance_df):
+        # Normalising
+        performance_df = performance_df / performance_df.iloc[0]
+    return performance_df, pd.DataFrame(windows)
+
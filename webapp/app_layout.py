@@ -1,5 +1,9 @@
 from dash import html, dcc
 import dash_bootstrap_components as dbc
+from strategy.pairs_selection import SCORERS
+
+# Training durations offered to the user, also the ones precomputed by the warm up job
+TRAIN_DURATIONS_MONTHS = [6, 12, 18, 24]
 
 LABEL_STYLE = {
     'fontWeight': 'bold',
@@ -83,11 +87,9 @@ def gen_layout():
                                                                        style=LABEL_STYLE),
                                                             dcc.Dropdown(
                                                                 id='train_duration_dd',
-                                                                options=[{"label": "6 months", "value": 6},
-                                                                         {"label": "12 months", "value": 12},
-                                                                         {"label": "18 months", "value": 18},
-                                                                         {"label": "24 months", "value": 24}],
-                                                                value=6,
+                                                                options=[{"label": f"{months} months", "value": months}
+                                                                         for months in TRAIN_DURATIONS_MONTHS],
+                                                                value=TRAIN_DURATIONS_MONTHS[0],
                                                                 multi=False,
                                                                 clearable=False
                                                             )
@@ -128,9 +130,8 @@ def gen_layout():
                                                                        style=LABEL_STYLE),
                                                             dcc.Dropdown(
                                                                 id='method_dd',
-                                                                options=[{"label": "MDM", "value": "MDM"},
-                                                                         {"label": "MFR", "value": "MFR"},
-                                                                         {"label": "G", "value": "G"}],
+                                                                options=[{"label": method, "value": method}
+                                                                         for method in SCORERS],
                                                                 value="MDM",
                                                                 multi=False,
                                                                 clearable=False
@@ -149,15 +150,11 @@ def gen_layout():
                                                     children=[
                                                         html.Div([
                                                             html.P([
-                                                                html.B("MDM: "), "Select pairs where the sum of squared distances between cumulative returns of two stocks is the minimum",
-                                                                html.Br(),
-                                                                html.Br(),
-                                                                html.B("MFR: "), "Select pairs with minimum market factor ratio, an indicator that is the ratio of market betas of the two stocks",
-                                                                html.Br(),
-                                                                html.Br(),
-                                                                html.B("G: "), "Select pairs with minimum sum of p-value of 2 Granger-Causality tests. The test determines whether price of one stock is useful in predicting the price of another",
-                                                                html.Br(),
-                                                                html.Br(),
+                                                                *[element for method, scorer in SCORERS.items()
+                                                                  for element in [html.B(f"{method}: "),
+                                                                                  scorer["description"],
+                                                                                  html.Br(),
+                                                                                  html.Br()]],
                                                                 html.Br(),
                                                                 "In each instance only top 5 pairs are selected for trading"
                                                             ],
@@ -173,16 +170,17 @@ def gen_layout():
                                 html.Div(
                                     className='col-sm-8',
                                     children=[
-                                        # Cache to store prices
-                                        html.Script(
-                                            id="securities_price_cache",
-                                            type="text/json",
+                                        # Key of the prices and generated pairs in the server side result store
+                                        html.Div(
+                                            id="dataset_key",
+                                            style={"display": "none"},
                                             children=[]
                                         ),
-                                        # Cache to store the generated pairs
-                                        html.Script(
-                                            id="generated_pairs_cache",
-                                            type="text/json",
+                                        # Key of a dataset that was gone from the result store when read, so that it is generated
+                                        # again
+                                        html.Div(
+                                            id="missing_dataset_key",
+                                            style={"display": "none"},
                                             children=[]
                                         ),
                                         # Title Row
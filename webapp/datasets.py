@@ -0,0 +1,202 @@
+import os
+import threading
+import time
+import pandas as pd
+from functools import lru_cache
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Tuple, List, Optional
+from data_process.db_connector.mysql_connector import MySqlConnector
+from data_process.data_fetcher import fetch_securities
+from data_process.data_fetcher.constituents_index import ConstituentsIndex
+from data_process.data_fetcher.incremental_loader import IncrementalPriceLoader
+from data_process.price_store.local_price_store import LocalPriceStore
+from strategy import pairs_selection, tracing
+from strategy.score_cache import PairScoreCache
+from webapp import jobs
+from webapp.app_layout import TRAIN_DURATIONS_MONTHS
+from webapp.result_store import ResultStore
+
+curr_dir_path = Path(__file__).resolve().parent
+# Number of months tested by default, the default test start date is that many months before today
+DEFAULT_TEST_DURATION_MONTHS = 6
+# How long the index details are used before being fetched again
+INDEX_DATA_TTL_SECONDS = 3600
+
+# Local copy of the prices, so that the DB is only hit for prices that have not been synced yet
+price_store = LocalPriceStore(root_dir=os.environ.get("PRICE_STORE_DIR",
+                                                      os.path.join(curr_dir_path.parent, "cache", "price_store")))
+# Generated pair scores are persisted so they are only computed once per index and window
+score_cache = PairScoreCache(db_path=os.environ.get("PAIR_SCORE_CACHE_PATH",
+                                                    os.path.join(curr_dir_path.parent, "cache", "pair_scores.sqlite")))
+# Prices and generated pairs are kept server side, the browser only gets the key of the dataset
+result_store = ResultStore(root_dir=os.environ.get("RESULT_STORE_DIR",
+                                                   os.path.join(curr_dir_path.parent, "cache", "results")))
+
+
+# The DB is only connected to on first use, so that a worker can start even if the DB is slow
+@lru_cache(maxsize=None)
+def get_db_conn() -> MySqlConnector:
+    return MySqlConnector(conn_json_path=os.path.join(curr_dir_path.parent, "db_conn_details.json"))
+
+
+@lru_cache(maxsize=None)
+def get_constituents_index() -> ConstituentsIndex:
+    # Snapshots of the indices kept in memory, so constituents are only queried again when a new snapshot arrives.
+    # Only worth it in a long lived process generating many datasets, like the warm up job: the background callbacks
+    # each run in a new process, where it would be rebuilt on every job
+    return ConstituentsIndex(db_conn=get_db_conn())
+
+
+_index_data = {"loaded_at": None, "index_data": None}
+_index_data_lock = threading.Lock()
+
+
+def get_index_data(force_refresh: bool = False) -> pd.DataFrame:
+    """
+    Index details, fetched on first use and then at most every INDEX_DATA_TTL_SECONDS. This is used to determine
+    when the simulations can start for each exchange
+    :param force_refresh: Fetch them again even if the cached ones are not expired
+    :return: Index details by index_code
+    """
+    with _index_data_lock:
+        loaded_at = _index_data["loaded_at"]
+        if force_refresh or loaded_at is None or time.monotonic() - loaded_at > INDEX_DATA_TTL_SECONDS:
+            _index_data["index_data"] = fetch_securities.fetch_indices(db_conn=get_db_conn()).set_index("index_code")
+            _index_data["loaded_at"] = time.monotonic()
+        return _index_data["index_data"]
+
+
+def gen_default_test_start_date() -> pd.Timestamp:
+    # Adding 1 as a buffer to cover mid month dates
+    return pd.to_datetime(pd.Timestamp.today().normalize() - pd.offsets.MonthBegin(DEFAULT_TEST_DURATION_MONTHS + 1))
+
+
+def gen_fetch_dates(test_start_date: datetime, training_duration: int) -> Tuple[pd.Timestamp, pd.Timestamp]:
+    """
+    :param test_start_date: from when the strategy starts trading
+    :param training_duration: Number of months used to select the pairs
+    :return: Range of prices needed to select the pairs and backtest them
+    """
+    fetch_start_date = pd.to_datetime(test_start_date) - pd.offsets.MonthBegin(training_duration + 1)
+    fetch_end_date = pd.Timestamp.today().normalize()
+    return fetch_start_date, fetch_end_date
+
+
+def gen_dataset_key(index_code: str, fetch_start_date: datetime, fetch_end_date: datetime) -> str:
+    """
+    :return: Key of the dataset in the result store, the same for every user asking for the same data with the same
+             prices synced
+    """
+    return jobs.gen_job_key(index_code=index_code,
+                            fetch_start_date=fetch_start_date,
+                            fetch_end_date=fetch_end_date,
+                            # Changes once prices loaded after the dataset was generated are synced
+                            prices_synced_end=price_store.synced_range[1],
+                            # Datasets stored before a scoring method or setting changed lack its scores
+                            scoring_version=pairs_selection.gen_scoring_version(
+                                methods=pairs_selection.get_scoring_methods()))[:16]
+
+
+def gen_prices_and_pairs(selected_index: str,
+                         fetch_start_date: datetime,
+                         fetch_end_date: datetime,
+                         report_progress: Callable[[str], None],
+                         constituents_index: Optional[ConstituentsIndex] = None) -> str:
+    """
+    Fetches the prices of the index and its constituents, scores all their pairs and stores both in the
+    result store
+    :param constituents_index: Resolves the constituents when given, e.g. output of get_constituents_index. They are
+                               fetched with a single query otherwise
+    :return: Key of the dataset in the result store
+    """
+    report_progress("Fetching prices")
+    db_conn = get_db_conn()
+    with tracing.span("fetch_dataset", index=selected_index) as fetch_span:
+        fetched_prices = fetch_securities.get_all_data(db_conn=db_conn,
+                                                       sim_start_date=fetch_start_date,
+                                                       sim_end_date=fetch_end_date,
+                                                       index_code=selected_index,
+                                                       price_store=price_store,
+                                                       constituents_index=constituents_index)
+        index_security_code = get_index_data().loc[selected_index]["security_code"]
+        index_price = fetch_securities.fetch_prices_from_store(db_conn=db_conn,
+                                                               price_store=price_store,
+                                                               securities_list=[index_security_code],
+                                                               start_date=fetch_start_date,
+                                                               end_date=fetch_end_date)
+        fetched_prices["index"] = index_price[index_security_code]
+        fetch_span.set(rows=len(fetched_prices), securities=fetched_prices.shape[1])
+    report_progress("Scoring pairs")
+    generated_pairs = pairs_selection.generate_pairs_and_scores(
+        prices_df=fetched_prices,
+        cache=score_cache,
+        cache_tag=selected_index,
+        progress_callback=lambda n_done, n_blocks: report_progress(f"Scoring pairs {n_done}/{n_blocks}"))
+    with tracing.span("store_dataset", pairs=len(generated_pairs)) as store_span:
+        dataset_key = result_store.put(frames={"prices": fetched_prices, "pairs": generated_pairs},
+                                       key=gen_dataset_key(index_code=selected_index,
+                                                           fetch_start_date=fetch_start_date,
+                                                           fetch_end_date=fetch_end_date))
+        if tracing.is_enabled():
+            store_span.set(payload_bytes=int(fetched_prices.memory_usage().sum() +
+                                             generated_pairs.memory_usage().sum()))
+    return dataset_key
+
+
+def sync_prices() -> Dict[str, Any]:
+    """
+    Append the prices loaded since the last sync to the price store, and drop the stored datasets that include a
+    security with new prices. The keys of the datasets change with the synced prices, so they are regenerated with
+    the new prices on their next request or warm up
+    :return: Output of IncrementalPriceLoader.sync, and the keys of the datasets dropped
+    """
+    sync_report = IncrementalPriceLoader(db_conn=get_db_conn(), price_store=price_store).sync()
+    updated_securities = set(sync_report["updated_securities"])
+    dropped_keys = []
+    if updated_securities:
+        for dataset_key in result_store.recent_keys():
+            try:
+                stale = bool(updated_securities.intersection(result_store.get_columns(dataset_key, "prices")))
+            except OSError:
+                # Removed by another worker in between
+                continue
+            if stale:
+                result_store.remove(dataset_key)
+                dropped_keys.append(dataset_key)
+    return {**sync_report, "dropped_datasets": dropped_keys}
+
+
+def gen_default_dataset_keys() -> List[Tuple[str, int, str]]:
+    """
+    :return: Index, training duration and dataset key of every dataset shown by default, i.e. with the default
+             test start date
+    """
+    test_start_date = gen_default_test_start_date()
+    dataset_keys = []
+    for index_code in get_index_data().index:
+        for training_duration in TRAIN_DURATIONS_MONTHS:
+            fetch_start_date, fetch_end_date = gen_fetch_dates(test_start_date=test_start_date,
+                                                               training_duration=training_duration)
+            dataset_keys.append((index_code, training_duration, gen_dataset_key(index_code=index_code,
+                                                                                fetch_start_date=fetch_start_date,
+                                                                                fetch_end_date=fetch_end_date)))
+    return dataset_keys
+
+
+def preload_recent_datasets() -> int:
+    """
+    Load the most recently generated datasets, e.g. the default ones stored by the warm up job, into the memory of
+    this worker. They are listed from the result store directory, so this never touches the DB
+    :return: Number of datasets loaded
+    """
+    n_loaded = 0
+    # Oldest first, so that the most recent ones end up the most recently used in memory
+    for dataset_key in reversed(result_store.recent_keys(n=result_store.max_entries)):
+        try:
+            result_store.get(dataset_key)
+        except (KeyError, OSError):
+            # Removed by another worker in between
+            continue
+        n_loaded += 1
+    return n_loaded
@@ -0,0 +1,62 @@
+import cProfile
+import os
+import time
+import diskcache
+from flask import Flask, g, jsonify, request
+from pathlib import Path
+from typing import Callable, Dict
+from strategy import tracing
+
+curr_dir_path = Path(__file__).resolve().parent
+# Spans of every worker and background job go to this shared directory, so the stats cover all of them
+TRACES_DIR = os.environ.get("TRACES_DIR", os.path.join(curr_dir_path.parent, "cache", "traces"))
+# Requests are profiled with cProfile when this is set and they carry the profile cookie or header
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+PROFILE_FLAG = "X-Profile"
+
+
+def _is_profiled_request() -> bool:
+    return request.headers.get(PROFILE_FLAG) == "1" or request.cookies.get("profile") == "1"
+
+
+def register_instrumentation(server: Flask, stats_providers: Dict[str, Callable[[], dict]]):
+    """
+    Hook the tracing and the optional profiling into the Flask server of the app. Spans are only recorded when the
+    TRACING_ENABLED env variable is 1, otherwise this only adds the stats endpoint
+    :param server: Flask server of the Dash app
+    :param stats_providers: Extra stats to show at the endpoint by name, e.g. the memo hit/miss counters
+    """
+    if tracing.is_enabled():
+        shared_samples = diskcache.Deque(directory=TRACES_DIR, maxlen=tracing.MAX_SAMPLES)
+        tracing.enable(sink=shared_samples.append)
+    else:
+        shared_samples = []
+
+    @server.route("/internal/stats")
+    def internal_stats():
+        """
+        p50/p95 per stage over the last spans of all the workers, along with the other stats
+        """
+        return jsonify({"tracing_enabled": tracing.is_enabled(),
+                        "stages": tracing.summarize(list(shared_samples)),
+                        **{name: provider() for name, provider in stats_providers.items()}})
+
+    if PROFILE_DIR is None:
+        return
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+
+    @server.before_request
+    def start_profile():
+        if _is_profiled_request():
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @server.after_request
+    def save_profile(response):
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            # Open with pstats or snakeviz
+            file_name = f"{time.time_ns()}-{request.path.strip('/').replace('/', '_') or 'root'}.prof"
+            profiler.dump_stats(os.path.join(PROFILE_DIR, file_name))
+        return response
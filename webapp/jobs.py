@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import time
+import diskcache
+import psutil
+from dash import DiskcacheManager
+from pathlib import Path
+from typing import Any, Callable, Optional, Tuple
+
+curr_dir_path = Path(__file__).resolve().parent
+# Shared by all the gunicorn workers, so that every worker sees the jobs started by the others
+JOB_CACHE_DIR = os.environ.get("JOB_CACHE_DIR", os.path.join(curr_dir_path.parent, "cache", "jobs"))
+# How long the result of a job is kept for the identical jobs waiting on it
+JOB_RESULT_EXPIRY_SECONDS = 600
+# A job that has not finished after this long is considered dead and another one can take over. A job whose process
+# is gone, e.g. terminated by Dash when its user changed the inputs, is considered dead straight away
+JOB_LEASE_SECONDS = 1800
+JOB_POLL_INTERVAL_SECONDS = 1
+
+job_cache = diskcache.Cache(JOB_CACHE_DIR)
+# Runs the background callbacks in their own processes, off the gunicorn workers
+background_callback_manager = DiskcacheManager(job_cache)
+
+
+def gen_job_key(**job_inputs: Any) -> str:
+    """
+    :param job_inputs: Everything the output of the job depends on
+    :return: Key that is the same for identical jobs
+    """
+    serialised_inputs = json.dumps(job_inputs, sort_keys=True, default=str)
+    return hashlib.sha1(serialised_inputs.encode("utf-8")).hexdigest()
+
+
+def _gen_lease_holder() -> Tuple[int, float]:
+    # The start time of the process tells it apart from a later process that got the same pid
+    return os.getpid(), psutil.Process().create_time()
+
+
+def _is_alive(lease_holder: Optional[Tuple[int, float]]) -> bool:
+    if lease_holder is None:
+        return False
+    pid, create_time = lease_holder
+    try:
+        return psutil.Process(pid).create_time() == create_time
+    except psutil.NoSuchProcess:
+        return False
+
+
+def _release_dead_lease(lease_key: str):
+    """
+    Drop the lease of a job whose process was killed before it could release it
+    """
+    with job_cache.transact():
+        lease_holder = job_cache.get(lease_key)
+        if lease_holder is not None and not _is_alive(lease_holder):
+            job_cache.delete(lease_key)
+
+
+def run_deduplicated_job(job_key: str,
+                         job_func: Callable[[Callable[[str], None]], Any],
+                         set_progress: Callable[[str], None]) -> Any:
+    """
+    Run a job unless an identical one is already running, in which case its progress is followed and its result
+    returned once it is done. The first job takes a lease on the key, the others poll for the result
+    :param job_key: Output of gen_job_key
+    :param job_func: Does the work, gets a function to report its progress with. Must not return None
+    :param set_progress: Reports the progress to the user who started this job
+    :return: Output of job_func
+    """
+    result_key, lease_key, progress_key = f"{job_key}:result", f"{job_key}:lease", f"{job_key}:progress"
+
+    def report_progress(message: str):
+        job_cache.set(progress_key, message, expire=JOB_LEASE_SECONDS)
+        set_progress(message)
+
+    while True:
+        result = job_cache.get(result_key)
+        if result is not None:
+            return result
+        if job_cache.add(lease_key, _gen_lease_holder(), expire=JOB_LEASE_SECONDS):
+            try:
+                # The job holding the lease before may have finished in between
+                result = job_cache.get(result_key)
+                if result is not None:
+                    return result
+                result = job_func(report_progress)
+                job_cache.set(result_key, result, expire=JOB_RESULT_EXPIRY_SECONDS)
+                return result
+            finally:
+                job_cache.delete(lease_key)
+        set_progress(job_cache.get(progress_key, "Waiting for an identical job"))
+        time.sleep(JOB_POLL_INTERVAL_SECONDS)
+        _release_dead_lease(lease_key)
+
+
+def discard_result(job_key: str):
+    """
+    Forget the result of a finished job, so that the next identical job runs again rather than returning it
+    :param job_key: Output of gen_job_key
+    """
+    job_cache.delete(f"{job_key}:result")
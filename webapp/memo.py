@@ -0,0 +1,52 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable
+
+
+class LruMemo:
+    """
+    Bounded memoization of results by key, the least recently used results are evicted once there are more than
+    max_entries. Counts hits and misses so the hit rate can be monitored
+    """
+
+    def __init__(self, max_entries: int = 256):
+        """
+        :param max_entries: Maximum number of results kept
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._results: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key: Hashable, compute_func: Callable[[], Any]) -> Any:
+        """
+        :param key: Everything the result depends on
+        :param compute_func: Computes the result when it is not memoized yet
+        :return: Memoized or freshly computed result
+        """
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                self._results.move_to_end(key)
+                return self._results[key]
+            self.misses += 1
+        # Computed outside of the lock, so a slow computation does not hold up the hits
+        result = compute_func()
+        with self._lock:
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.max_entries:
+                self._results.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: Number of hits, misses and results currently kept
+        """
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._results)}
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
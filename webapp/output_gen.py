@@ -1,13 +1,15 @@
 import pandas as pd
-from plotly import graph_objs as go
 from dash import html
+import dash_bootstrap_components as dbc
 from typing import List, Any
 
 
-def plot_performance(performance_df: pd.DataFrame, chart_title: str) -> go.Figure:
+def plot_performance(performance_df: pd.DataFrame, chart_title: str) -> "go.Figure":
     """
     Generate a plot of all the regression outputs
     """
+    # plotly.graph_objs is slow to import, so it is only imported when the first plot is made
+    from plotly import graph_objs as go
     traces = [
         go.Scatter(
             x=performance_df.index,
@@ -58,3 +60,12 @@ def gen_html_tbl_from_df(inp_df: pd.DataFrame) -> List[Any]:
         for ind, row in inp_df.iterrows()
     ]
     return tbl_header + rows
+
+
+def gen_progress_message(message: str) -> html.Div:
+    """
+    Small spinner followed by the progress of a background job
+    """
+    return html.Div(style={"whiteSpace": "nowrap"},
+                    children=[dbc.Spinner(color="dark", size="sm"),
+                              html.Span(message, style={"marginLeft": "10px"})])
@@ -0,0 +1,121 @@
+import os
+import shutil
+import threading
+import uuid
+import pandas as pd
+import pyarrow.parquet as pq
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+class ResultStore:
+    """
+    Server side store of the dataframes behind a dataset (prices and generated pairs), so that the callbacks only
+    pass a short key around instead of the dataframes themselves. Every dataset is written to a shared directory as
+    parquet, and each worker keeps the most recently used ones in memory. A hit in memory returns the stored
+    dataframes as they are, without copying or parsing them, so they must not be modified by the callers
+    """
+
+    def __init__(self, root_dir: str, max_entries: int = 16, max_disk_entries: int = 256):
+        """
+        :param root_dir: Directory shared by all the workers, created if it does not exist
+        :param max_entries: Maximum number of datasets kept in memory by each worker
+        :param max_disk_entries: Maximum number of datasets kept on disk, the least recently written are removed
+        """
+        self.root_dir = root_dir
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        os.makedirs(root_dir, exist_ok=True)
+        self._entries: "OrderedDict[str, Dict[str, pd.DataFrame]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root_dir, key)
+
+    def _remember(self, key: str, frames: Dict[str, pd.DataFrame]):
+        with self._lock:
+            self._entries[key] = frames
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def put(self, frames: Dict[str, pd.DataFrame], key: Optional[str] = None) -> str:
+        """
+        :param frames: Dataframes of the dataset by name, e.g. {"prices": prices_df, "pairs": pairs_df}
+        :param key: Key to store them under, a random one is generated if not given
+        :return: Key of the dataset
+        """
+        key = key or uuid.uuid4().hex[:16]
+        entry_dir = self._entry_dir(key)
+        # Keys are deterministic, an existing entry holds the same dataset and may be being read by another worker
+        if not os.path.isdir(entry_dir):
+            # Written to a temporary directory first, so other workers never read a partially written dataset
+            tmp_dir = self._entry_dir(f".{key}.{uuid.uuid4().hex}")
+            os.makedirs(tmp_dir)
+            for name, frame in frames.items():
+                frame.to_parquet(os.path.join(tmp_dir, f"{name}.parquet"))
+            try:
+                os.replace(tmp_dir, entry_dir)
+            except OSError:
+                # Another worker stored the same key in between
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        self._remember(key, frames)
+        self._remove_old_entries()
+        return key
+
+    def get(self, key: str) -> Dict[str, pd.DataFrame]:
+        """
+        :param key: Output of put
+        :return: Dataframes of the dataset by name
+        """
+        with self._lock:
+            frames = self._entries.get(key)
+            if frames is not None:
+                self._entries.move_to_end(key)
+                return frames
+        entry_dir = self._entry_dir(key)
+        if not os.path.isdir(entry_dir):
+            raise KeyError(f"No dataset stored under {key}")
+        frames = {file_name[:-len(".parquet")]: pd.read_parquet(os.path.join(entry_dir, file_name))
+                  for file_name in os.listdir(entry_dir) if file_name.endswith(".parquet")}
+        self._remember(key, frames)
+        return frames
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries or os.path.isdir(self._entry_dir(key))
+
+    def get_columns(self, key: str, name: str) -> List[str]:
+        """
+        Columns of one dataframe of a dataset, read from the parquet schema without loading the data
+        :param key: Output of put
+        :param name: Name of the dataframe, e.g. prices
+        """
+        with self._lock:
+            frames = self._entries.get(key)
+        if frames is not None:
+            return list(frames[name].columns)
+        return pq.read_schema(os.path.join(self._entry_dir(key), f"{name}.parquet")).names
+
+    def remove(self, key: str):
+        """
+        Drop a dataset from the disk and from the memory of this worker
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def recent_keys(self, n: Optional[int] = None) -> List[str]:
+        """
+        :param n: Maximum number of keys, all of them if not given
+        :return: Keys of the datasets on disk, the most recently written first
+        """
+        entries = [entry for entry in os.scandir(self.root_dir) if entry.is_dir() and not entry.name.startswith(".")]
+        entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        return [entry.name for entry in entries[:n]]
+
+    def _remove_old_entries(self):
+        entry_dirs = [entry.path for entry in os.scandir(self.root_dir)
+                      if entry.is_dir() and not entry.name.startswith(".")]
+        entry_dirs.sort(key=os.path.getmtime)
+        for entry_dir in entry_dirs[:max(len(entry_dirs) - self.max_disk_entries, 0)]:
+            shutil.rmtree(entry_dir, ignore_errors=True)
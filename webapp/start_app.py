@@ -2,16 +2,16 @@ import dash
 import pandas as pd
 from dash.dependencies import Input, Output, State
 from flask import Flask
-from typing import Union, List
-from data_process.db_connector.mysql_connector import MySqlConnector
-from data_process.data_fetcher import fetch_securities
-from strategy import pairs_selection, backtesting
-from webapp import app_layout, output_gen
+from typing import Union, List, Callable, Any, Dict
+from strategy import pairs_selection, backtesting, tracing
+from dash.exceptions import PreventUpdate
+from webapp import app_layout, output_gen, jobs, datasets
+from webapp.instrumentation import register_instrumentation
+from webapp.memo import LruMemo
 from datetime import datetime
-from pathlib import Path
 import os
+import threading
 
-curr_dir_path = Path(__file__).resolve().parent
 server = Flask(__name__)
 external_stylesheets = ["https://stackpath.bootstrapcdn.com/bootstrap/4.3.1/css/bootstrap.min.css",
                         "https://fonts.googleapis.com/css?family=Quicksand:400,700&display=swap",
@@ -27,17 +27,17 @@ app = dash.Dash(__name__,
                 server=server)
 app.config["suppress_callback_exceptions"] = True
 app.title = "Pair Trader"
-app.layout = app_layout.gen_layout()
-db_conn = MySqlConnector(conn_json_path=os.path.join(curr_dir_path.parent, "db_conn_details.json"))
-index_data = pd.DataFrame()
-
-
-def update_index_details():
-    global index_data
-    # This is used to determine when the simulations can start for each exchange
-    index_data = fetch_securities.fetch_indices(db_conn=db_conn).set_index("index_code")
-
-update_index_details()
+# Built when the page is served rather than when the worker starts
+app.layout = app_layout.gen_layout
+# Backtest outputs per dataset and dashboard settings
+backtest_memo = LruMemo(max_entries=256)
+# Pairs of each dataset pre-sorted per selection method
+selection_index_memo = LruMemo(max_entries=16)
+# Stage timings at /internal/stats, spans are only recorded with TRACING_ENABLED=1
+register_instrumentation(server=server, stats_providers={"backtest_memo": backtest_memo.stats,
+                                                         "selection_index_memo": selection_index_memo.stats})
+# The precomputed datasets are read in the background, so that the worker starts serving straight away
+threading.Thread(target=datasets.preload_recent_datasets, daemon=True).start()
 
 
 @app.callback([Output("test_start_date_picker", "date"),
@@ -49,102 +49,186 @@ def set_test_date_ranges(selected_index: str, training_period: int):
     """
     Sets the min/max test dates depending on the chosen index, based on how much data is available
     """
-    chosen_index_details = index_data.loc[selected_index]
+    chosen_index_details = datasets.get_index_data().loc[selected_index]
     min_snapshot_date = chosen_index_details["min_snapshot_date"].date()
-    default_test_duration_months = 6
     # Adding 1 as a buffer to cover mid month dates
     min_allowed_test_start_date = min_snapshot_date + pd.offsets.MonthBegin(training_period + 1)
     # Get the start of previous month as the max test start date
     max_allowed_test_start_date = pd.Timestamp.today().normalize() - pd.offsets.MonthBegin(2)
-    # Adding 1 as a buffer to cover mid month dates
-    default_test_start_date = pd.to_datetime(pd.Timestamp.today().normalize() - pd.offsets.MonthBegin(default_test_duration_months + 1))
+    default_test_start_date = datasets.gen_default_test_start_date()
     return default_test_start_date, min_allowed_test_start_date, max_allowed_test_start_date
 
-@app.callback([Output("securities_price_cache", "children"),
-               Output("generated_pairs_cache", "children"),
-               Output("output_spinner", "children")],
+
+@app.callback(Output("dataset_key", "children"),
               [Input("index_dd", "value"),
                Input("train_duration_dd", "value"),
                Input("test_start_date_picker", "date"),
-               ])
-def fetch_and_store_prices(selected_index: str, training_duration: int, test_start_date: Union[datetime, str]):
+               Input("missing_dataset_key", "children"),
+               ],
+              background=True,
+              manager=jobs.background_callback_manager,
+              progress=[Output("output_spinner", "children")],
+              running=[(Output("output_spinner", "children"), output_gen.gen_progress_message("Starting"), "")])
+def fetch_and_store_prices(set_progress: Callable[[Any], None],
+                           selected_index: str,
+                           training_duration: int,
+                           test_start_date: Union[datetime, str],
+                           missing_dataset_key: str):
     """
-    Fetches the appropriate prices and caches them into the DOM
+    Fetches the appropriate prices and stores them server side, only their key goes to the DOM. Runs as a
+    background job, users asking for the same data at the same time share a single job. Runs again when the dataset
+    was dropped from the result store, e.g. evicted or made stale by a price sync, to generate it anew
     """
-    fetch_start_date = pd.to_datetime(test_start_date) - pd.offsets.MonthBegin(training_duration + 1)
-    fetch_end_date = pd.Timestamp.today().normalize()
-    fetched_prices = fetch_securities.get_all_data(db_conn=db_conn,
-                                                   sim_start_date=fetch_start_date,
-                                                   sim_end_date=fetch_end_date,
-                                                   index_code=selected_index)
-    index_price = fetch_securities.fetch_prices(db_conn=db_conn,
-                                                securities_list=[index_data.loc[selected_index]["security_code"]],
-                                                start_date=fetch_start_date,
-                                                end_date=fetch_end_date)
-    fetched_prices["index"] = index_price
-    generated_pairs = pairs_selection.generate_pairs_and_scores(prices_df=fetched_prices)
-    generated_pairs_json = generated_pairs.reset_index().to_json(orient="records")
-    fetched_prices = fetched_prices.reset_index()
-    fetched_prices["close_date"] = fetched_prices["close_date"].dt.strftime("%Y-%m-%d")
-    prices_json = fetched_prices.to_json(orient="records")
-    return prices_json, generated_pairs_json, ""
-
-
-
-@app.callback(Output("pairs_summary_tbl", "children"),
-              [Input("generated_pairs_cache", "children"),
+    fetch_start_date, fetch_end_date = datasets.gen_fetch_dates(test_start_date=test_start_date,
+                                                                training_duration=training_duration)
+    dataset_key = datasets.gen_dataset_key(index_code=selected_index,
+                                           fetch_start_date=fetch_start_date,
+                                           fetch_end_date=fetch_end_date)
+    if dataset_key in datasets.result_store:
+        # Already generated, e.g. by the warm up job
+        return dataset_key
+    # The result of the job that generated the dataset before only holds its key
+    jobs.discard_result(job_key=dataset_key)
+    with tracing.span("fetch_and_store_prices"):
+        return jobs.run_deduplicated_job(
+            job_key=dataset_key,
+            job_func=lambda report_progress: datasets.gen_prices_and_pairs(selected_index=selected_index,
+                                                                           fetch_start_date=fetch_start_date,
+                                                                           fetch_end_date=fetch_end_date,
+                                                                           report_progress=report_progress),
+            set_progress=lambda message: set_progress(output_gen.gen_progress_message(message)))
+
+
+def handle_missing_dataset(dataset_key: str, n_outputs: int) -> tuple:
+    """
+    Called when reading a dataset failed. Sends its key to fetch_and_store_prices when it is gone from the result
+    store, which generates it again and updates dataset_key, re-running the callbacks reading it
+    :param dataset_key: Key of the dataset read
+    :param n_outputs: Number of outputs of the callback, left as they are
+    :return: Outputs of the callback, followed by the missing dataset key
+    """
+    if dataset_key in datasets.result_store:
+        # Not a missing dataset, the read failed for another reason
+        raise
+    return (dash.no_update,) * n_outputs + (dataset_key,)
+
+
+def get_selection_index(dataset_key: str) -> pairs_selection.PairSelectionIndex:
+    return selection_index_memo.get_or_compute(
+        key=dataset_key,
+        compute_func=lambda: pairs_selection.PairSelectionIndex.from_pairs_df(
+            datasets.result_store.get(dataset_key)["pairs"]))
+
+
+@app.callback([Output("pairs_summary_tbl", "children"),
+               Output("missing_dataset_key", "children")],
+              [Input("dataset_key", "children"),
                Input("method_dd", "value")])
-def generate_pairs_summary_table(cached_pairs_metrics: str, chosen_method: str):
+def generate_pairs_summary_table(dataset_key: str, chosen_method: str):
     """
     Generate the table to display the selected pairs
     """
-    pairs_df = pd.read_json(cached_pairs_metrics).set_index("PAIR")
+    if not dataset_key:
+        raise PreventUpdate
+    try:
+        pairs_df = datasets.result_store.get(dataset_key)["pairs"]
+        selection_index = get_selection_index(dataset_key)
+    except KeyError:
+        return handle_missing_dataset(dataset_key=dataset_key, n_outputs=1)
     selected_pairs = pairs_selection.select_top_n_pairs(generated_pairs_df=pairs_df,
                                                         selection_method=chosen_method,
-                                                        n=5).round(4).reset_index()
+                                                        n=5,
+                                                        selection_index=selection_index
+                                                        ).round(4).reset_index()
     selected_pairs["PAIR"] = selected_pairs["PAIR"].str.replace("\|", ", ")
-    return output_gen.gen_html_tbl_from_df(selected_pairs)
+    return output_gen.gen_html_tbl_from_df(selected_pairs), dash.no_update
+
+
+def gen_backtest_outputs(dataset_key: str,
+                         chosen_method: str,
+                         window_size: int,
+                         open_threshold: float,
+                         close_threshold: float,
+                         test_start_date: datetime,
+                         selected_index: str) -> Dict[str, Any]:
+    """
+    Backtest the pairs selected with the given method
+    :return: Performance df, metrics df, metrics table and the serialised figure
+    """
+    with tracing.span("load_dataset"):
+        dataset = datasets.result_store.get(dataset_key)
+        prices_df, pairs_df = dataset["prices"], dataset["pairs"]
+    with tracing.span("select_pairs", pairs=len(pairs_df)):
+        selected_pairs = pairs_selection.select_top_n_pairs(generated_pairs_df=pairs_df,
+                                                            selection_method=chosen_method,
+                                                            n=5,
+                                                            selection_index=get_selection_index(dataset_key))
+    with tracing.span("backtest", rows=len(prices_df), pairs=len(selected_pairs)):
+        strategy_performance = backtesting.get_performance(chosen_pairs=list(selected_pairs.index),
+                                                           prices_df=prices_df,
+                                                           test_start_date=test_start_date,
+                                                           window_size=window_size,
+                                                           open_threshold=open_threshold,
+                                                           close_threshold=close_threshold)
+    with tracing.span("performance_metrics"):
+        performance_metrics = backtesting.gen_performance_metrics(performance_df=strategy_performance).round(3)
+        index_full_name = datasets.get_index_data().loc[selected_index]["index_name"]
+        performance_metrics["Type"] = performance_metrics["Type"].str.title().replace("Index", index_full_name)
+        perf_metrics_tbl = output_gen.gen_html_tbl_from_df(performance_metrics)
+    with tracing.span("build_figure", rows=len(strategy_performance)) as figure_span:
+        perf_chart = output_gen.plot_performance(performance_df=strategy_performance,
+                                                 chart_title=f"Strategy {chosen_method} performance vs. {index_full_name}")
+        perf_chart_dict = perf_chart.to_dict()
+        if tracing.is_enabled():
+            figure_span.set(payload_bytes=len(perf_chart.to_json()))
+    return {"performance_df": strategy_performance,
+            "performance_metrics": performance_metrics,
+            "perf_metrics_tbl": perf_metrics_tbl,
+            "perf_chart": perf_chart_dict}
 
 
 @app.callback([Output("output_plt", "figure"),
-               Output("score_summary_tbl", "children")],
-              [Input("generated_pairs_cache", "children"),
-               Input("securities_price_cache", "children"),
+               Output("score_summary_tbl", "children"),
+               Output("missing_dataset_key", "children")],
+              [Input("dataset_key", "children"),
                Input("method_dd", "value"),
                Input("window_slider", "value"),
                Input("std_slider", "value")],
                [State("test_start_date_picker", "date"),
                 State("index_dd", "value"),])
-def generate_performance_plot(cached_pairs_metrics: str,
-                              cached_prices: str,
+def generate_performance_plot(dataset_key: str,
                               chosen_method: str,
                               window_size: int,
                               z_score_range: List[int],
                               test_start_date: Union[datetime, str],
                               selected_index: str):
     """
-    Generate the graph of performance comparison
+    Generate the graph of performance comparison. Users tend to go back and forth over the same settings, so the
+    outputs are memoized per dataset and settings
     """
-    prices_df = pd.read_json(cached_prices).set_index("close_date")
-    prices_df.index = pd.to_datetime(prices_df.index)
-    pairs_df = pd.read_json(cached_pairs_metrics).set_index("PAIR")
-    selected_pairs = pairs_selection.select_top_n_pairs(generated_pairs_df=pairs_df,
-                                                        selection_method=chosen_method,
-                                                        n=5)
-    strategy_performance = backtesting.get_performance(chosen_pairs=list(selected_pairs.index),
-                                                       prices_df=prices_df,
-                                                       test_start_date=pd.to_datetime(test_start_date),
-                                                       window_size=window_size,
-                                                       open_threshold=z_score_range[1],
-                                                       close_threshold=z_score_range[0])
-    performance_metrics = backtesting.gen_performance_metrics(performance_df=strategy_performance).round(3)
-    index_full_name = index_data.loc[selected_index]["index_name"]
-    performance_metrics["Type"] = performance_metrics["Type"].str.title().replace("Index", index_full_name)
-    perf_metrics_tbl = output_gen.gen_html_tbl_from_df(performance_metrics)
-    perf_chart = output_gen.plot_performance(performance_df=strategy_performance,
-                                             chart_title=f"Strategy {chosen_method} performance vs. {index_full_name}")
-
-    return perf_chart, perf_metrics_tbl
+    if not dataset_key:
+        raise PreventUpdate
+    test_start_date = pd.to_datetime(test_start_date)
+    open_threshold, close_threshold = z_score_range[1], z_score_range[0]
+    with tracing.span("generate_performance_plot", memo_hit=True) as plot_span:
+        def compute_backtest_outputs() -> dict:
+            plot_span.set(memo_hit=False)
+            return gen_backtest_outputs(dataset_key=dataset_key,
+                                        chosen_method=chosen_method,
+                                        window_size=window_size,
+                                        open_threshold=open_threshold,
+                                        close_threshold=close_threshold,
+                                        test_start_date=test_start_date,
+                                        selected_index=selected_index)
+
+        try:
+            backtest_outputs = backtest_memo.get_or_compute(
+                key=(dataset_key, chosen_method, window_size, open_threshold, close_threshold, test_start_date,
+                     selected_index),
+                compute_func=compute_backtest_outputs)
+        except KeyError:
+            return handle_missing_dataset(dataset_key=dataset_key, n_outputs=2)
+    return backtest_outputs["perf_chart"], backtest_outputs["perf_metrics_tbl"], dash.no_update
 
 
 ## RUN
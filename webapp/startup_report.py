@@ -0,0 +1,50 @@
+import argparse
+import subprocess
+import sys
+import time
+import pandas as pd
+from pathlib import Path
+
+root_dir_path = Path(__file__).resolve().parents[1]
+
+
+def gen_import_report(module: str = "webapp.start_app") -> pd.DataFrame:
+    """
+    Import a module in a fresh interpreter with -X importtime, which is what a web worker pays when it boots
+    :param module: Module to import
+    :return: Self and cumulative import time in ms of every module imported, slowest first, and the total wall
+             time in the attrs
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=root_dir_path, capture_output=True, text=True)
+    wall_time = time.perf_counter() - start
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    rows = []
+    for line in completed.stderr.splitlines():
+        # e.g. "import time:       516 |     422913 |   pandas"
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(),
+                     "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                     "self_ms": int(self_us) / 1000,
+                     "cumulative_ms": int(cumulative_us) / 1000})
+    report = pd.DataFrame(rows).sort_values("cumulative_ms", ascending=False).reset_index(drop=True)
+    report.attrs["wall_time_s"] = wall_time
+    return report
+
+
+## RUN
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report how long importing the webapp takes, module by module")
+    parser.add_argument("--module", default="webapp.start_app", help="Module to import")
+    parser.add_argument("--top", type=int, default=25, help="Number of modules to show")
+    parser.add_argument("--max-depth", type=int, default=1,
+                        help="Only show modules imported at most this deep, 0 being the ones imported directly")
+    args = parser.parse_args()
+    import_report = gen_import_report(module=args.module)
+    print(import_report[import_report["depth"] <= args.max_depth].head(args.top).to_string(index=False))
+    print(f"\nImporting {args.module} took {import_report.attrs['wall_time_s']:.2f}s wall time")
@@ -0,0 +1,51 @@
+import argparse
+from typing import List, Optional
+from webapp import datasets
+
+
+def warm_up(index_codes: Optional[List[str]] = None, force: bool = False, sync: bool = True) -> List[str]:
+    """
+    Generate the default dataset of every index and training duration into the result store, so that no user has
+    to wait for the pairs to be scored. Meant to run at deploy time and then daily, after the prices are loaded
+    :param index_codes: Indices to warm up, all of them by default
+    :param force: Regenerate the datasets that are already stored
+    :param sync: First pull the prices loaded since the last sync into the price store, and drop the datasets
+                 generated without them
+    :return: Keys of the datasets generated
+    """
+    datasets.get_index_data(force_refresh=True)
+    if sync:
+        sync_report = datasets.sync_prices()
+        print(f"Added {sync_report['rows_added']} prices for {len(sync_report['updated_securities'])} securities, "
+              f"dropped {len(sync_report['dropped_datasets'])} datasets")
+    test_start_date = datasets.gen_default_test_start_date()
+    generated_keys = []
+    for index_code, training_duration, dataset_key in datasets.gen_default_dataset_keys():
+        if index_codes is not None and index_code not in index_codes:
+            continue
+        if not force and dataset_key in datasets.result_store:
+            print(f"{index_code} {training_duration} months: already generated")
+            continue
+        print(f"{index_code} {training_duration} months: generating")
+        fetch_start_date, fetch_end_date = datasets.gen_fetch_dates(test_start_date=test_start_date,
+                                                                    training_duration=training_duration)
+        generated_keys.append(datasets.gen_prices_and_pairs(selected_index=index_code,
+                                                            fetch_start_date=fetch_start_date,
+                                                            fetch_end_date=fetch_end_date,
+                                                            report_progress=lambda message: None,
+                                                            # Shared by all the datasets of the run
+                                                            constituents_index=datasets.get_constituents_index()))
+    return generated_keys
+
+
+## RUN
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the pair scores shown by default in the webapp")
+    parser.add_argument("--index", dest="index_codes", action="append",
+                        help="Index to warm up, can be repeated. All of them by default")
+    parser.add_argument("--force", action="store_true", help="Regenerate the datasets that are already stored")
+    parser.add_argument("--no-sync", dest="sync", action="store_false",
+                        help="Do not pull the new prices into the price store first")
+    args = parser.parse_args()
+    keys = warm_up(index_codes=args.index_codes, force=args.force, sync=args.sync)
+    print(f"Generated {len(keys)} datasets")